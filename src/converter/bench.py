@@ -0,0 +1,266 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for the CSVW converter: end-to-end conversions of synthetic CSV files (and their schemas) in a single
+process and in parallel, and micro benchmarks of the helpers that are called for every cell.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import timeit
+import logging
+import datetime
+import platform
+import tempfile
+import resource
+import traceback
+import multiprocessing as mp
+import unicodecsv as csv
+from collections import OrderedDict
+
+try:
+    # Python 2
+    from csvw import CSVWConverter, BurstConverter
+    from util import get_namespaces, StreamingGraph
+except ImportError:
+    from .csvw import CSVWConverter, BurstConverter
+    from .util import get_namespaces, StreamingGraph
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+BASE = u"https://iisg.amsterdam"
+
+# The CSVW JSON-LD context, taken from the repository if we run from a checkout (to avoid fetching it)
+CSVW_CONTEXT = u"https://raw.githubusercontent.com/CLARIAH/COW/master/csvw.json"
+LOCAL_CSVW_CONTEXT = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))), 'csvw.json')
+
+# The synthetic datasets: number of columns, coded columns (with a valueUrl and collectionUrl), virtual columns,
+# the fraction of null values, and whether the templates are Jinja templates or plain Python format strings
+SCENARIOS = OrderedDict([
+    ('narrow', dict(columns=5, coded=0, virtual=0, nulls=0.0, jinja=False)),
+    ('wide', dict(columns=50, coded=0, virtual=0, nulls=0.0, jinja=False)),
+    ('coded', dict(columns=10, coded=5, virtual=0, nulls=0.0, jinja=False)),
+    ('virtual', dict(columns=10, coded=0, virtual=3, nulls=0.0, jinja=False)),
+    ('nulls', dict(columns=10, coded=2, virtual=0, nulls=0.3, jinja=False)),
+    ('jinja', dict(columns=10, coded=3, virtual=2, nulls=0.0, jinja=True))
+])
+
+WORDS = [u'amsterdam', u'rotterdam', u'utrecht', u'den haag', u'eindhoven', u'groningen', u'tilburg', u'almere',
+         u'breda', u'nijmegen', u'enschede', u'haarlem', u'arnhem', u'zaanstad', u'amersfoort', u'apeldoorn']
+CODES = [u'c{}'.format(i) for i in range(10)]
+
+
+def make_dataset(directory, name, rows, columns, coded=0, virtual=0, nulls=0.0, jinja=False, seed=1):
+    """Writes a synthetic CSV file ``name``.csv with ``rows`` rows and its CSVW schema to ``directory``,
+    and returns the path of the CSV file"""
+    rnd = random.Random(seed)
+    csv_file = os.path.join(directory, name + '.csv')
+    url = os.path.basename(csv_file)
+
+    context = CSVW_CONTEXT
+    if os.path.exists(LOCAL_CSVW_CONTEXT):
+        context = u'file://' + LOCAL_CSVW_CONTEXT
+
+    names = [u'id'] + [u'col{}'.format(i) for i in range(1, columns)]
+    schema_columns = []
+    for i, col in enumerate(names):
+        column = {u"@id": u"{}/{}/column/{}".format(BASE, url, col), u"name": col, u"datatype": u"string"}
+        if i == 0:
+            pass
+        elif i <= coded:
+            column[u"propertyUrl"] = u"sdv:{}".format(col)
+            column[u"valueUrl"] = u"code/{{{{{}|lower}}}}".format(col) if jinja else u"code/{{{}}}".format(col)
+            column[u"csvw:collectionUrl"] = {u"@id": u"{}/code".format(BASE)}
+        elif i % 2:
+            column[u"datatype"] = u"integer"
+        schema_columns.append(column)
+
+    for i in range(virtual):
+        if i % 2 == 0:
+            column = {u"virtual": True, u"propertyUrl": u"rdf:type", u"valueUrl": u"sdv:Observation"}
+        else:
+            column = {u"virtual": True, u"propertyUrl": u"rdfs:label", u"datatype": u"string",
+                      u"csvw:value": u"{{col1|upper}}" if jinja else u"{col1}"}
+        schema_columns.append(column)
+
+    metadata = {
+        u"@id": u"{}/{}".format(BASE, url),
+        u"@context": [context, {u"@language": u"en", u"@base": u"{}/".format(BASE)}, dict(get_namespaces(BASE))],
+        u"url": url,
+        u"dialect": {u"delimiter": u",", u"encoding": u"utf-8", u"quoteChar": u"\""},
+        u"tableSchema": {
+            u"columns": schema_columns,
+            u"primaryKey": u"id",
+            u"aboutUrl": u"obs/{{id}}" if jinja else u"obs/{id}",
+            u"null": [u"NA"]
+        }
+    }
+
+    with io.open(csv_file, 'w', encoding='utf-8', newline='') as f:
+        f.write(u','.join(names) + u'\r\n')
+        for r in range(rows):
+            values = [text(r)]
+            for i in range(1, columns):
+                if nulls and rnd.random() < nulls:
+                    value = rnd.choice([u'NA', u''])
+                elif i <= coded:
+                    value = rnd.choice(CODES)
+                elif i % 2:
+                    value = text(rnd.randint(0, 100000))
+                else:
+                    value = u'"{}, {}"'.format(rnd.choice(WORDS), rnd.choice(WORDS))
+                values.append(value)
+            f.write(u','.join(values) + u'\r\n')
+
+    with open(csv_file + '-metadata.json', 'w') as f:
+        f.write(json.dumps(metadata, indent=True))
+
+    return csv_file
+
+
+def text(value):
+    try:
+        # Python 2
+        return unicode(value)
+    except NameError:
+        # Python 3
+        return str(value)
+
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    """The peak resident set size (in KB) of this process, or (with ``RUSAGE_CHILDREN``) of its largest finished
+    child process. This is not the peak of the sum of the processes, which run at the same time."""
+    usage = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        # Reported in bytes instead of kilobytes
+        usage //= 1024
+    return usage
+
+
+def _convert(csv_file, processes, chunksize, results):
+    """Converts ``csv_file`` (in a separate process, so that memory use is measured per conversion),
+    and puts the duration, number of triples in the assertion graph and peak memory use on the ``results`` queue"""
+    try:
+        start = time.time()
+        c = CSVWConverter(csv_file, processes=processes, chunksize=chunksize, force=True)
+        c.convert()
+        seconds = time.time() - start
+
+        # Only the lines of the assertion graph are triples from the CSV file, the others are the nanopublication
+        suffix = StreamingGraph(c.np.ag.identifier, c.output_format).line_suffix.encode('utf-8')
+        with open(c.target_file, 'rb') as f:
+            triples = sum(1 for line in f if line.endswith(suffix))
+        results.put((seconds, triples, peak_rss(), peak_rss(resource.RUSAGE_CHILDREN)))
+    except:
+        traceback.print_exc()
+        results.put(None)
+
+
+def bench_conversion(csv_file, rows, processes, chunksize):
+    """Returns the throughput and memory use of converting ``csv_file`` in ``processes`` processes"""
+    results = mp.Queue()
+    p = mp.Process(target=_convert, args=(csv_file, processes, chunksize, results))
+    p.start()
+    result = results.get()
+    p.join()
+    if result is None:
+        raise Exception("Could not convert {}".format(csv_file))
+    seconds, triples, rss, worker_rss = result
+
+    return OrderedDict([
+        ('mode', 'simple' if processes == 1 else 'parallel'),
+        ('processes', processes),
+        ('chunksize', chunksize),
+        ('seconds', round(seconds, 3)),
+        ('rows_per_second', round(rows / seconds, 1)),
+        ('triples_per_second', round(triples / seconds, 1)),
+        ('triples', triples),
+        # The process that converts the file (and reads and writes it, with more than one process), and the largest
+        # of its worker processes
+        ('peak_rss_parent_kb', rss),
+        ('peak_rss_largest_worker_kb', worker_rss)
+    ])
+
+
+def time_call(function, number, repeat=3):
+    """Returns the fastest time (in microseconds) of calling ``function`` without arguments"""
+    return round(min(timeit.Timer(function).repeat(repeat=repeat, number=number)) / number * 1e6, 3)
+
+
+def bench_helpers(csv_file):
+    """Times the helpers of the :class:`BurstConverter` (and the schema wrapper) on the first row of ``csv_file``"""
+    converter = CSVWConverter(csv_file, processes=1)
+    plan = converter.plan
+    c = BurstConverter(converter.np.ag.identifier, plan, converter.encoding, 'nquads')
+
+    with open(csv_file, 'rb') as f:
+        row = next(csv.DictReader(f, encoding='utf-8'))
+    row[u'_row'] = 0
+
+    coded = [col for col in plan.columns if col.value_url is not None and not col.virtual]
+    literal = [col for col in plan.columns if col.value_url is None and col.name in row]
+
+    timings = OrderedDict()
+    timings['expandURL'] = time_call(lambda: c.expandURL(plan.about_url, row), 10000)
+    timings['expandURL_uncached'] = time_call(lambda: c.expandURL(plan.about_url, dict(row, id=text(random.random()))), 2000)
+    timings['render_pattern'] = time_call(lambda: c.render_pattern(plan.about_url, row), 10000)
+    if coded:
+        timings['render_pattern_value_url'] = time_call(lambda: c.render_pattern(coded[0].value_url, row), 10000)
+    if literal:
+        timings['isValueNull'] = time_call(lambda: c.isValueNull(row[literal[0].name], literal[0]), 100000)
+    timings['Item.__getattr__'] = time_call(lambda: converter.metadata.csvw_tableSchema, 100)
+
+    return timings
+
+
+def run_benchmarks(results_file, rows=10000, processes=(1, 2, 4), chunksizes=(500, 5000), scenarios=None):
+    """Converts a synthetic dataset with ``rows`` rows for each of the ``scenarios`` (default: all of :data:`SCENARIOS`)
+    in each number of ``processes`` and ``chunksizes`` (only for parallel conversions), times the helpers, and writes
+    the results to the JSON ``results_file``"""
+    if scenarios is None:
+        scenarios = list(SCENARIOS)
+
+    results = OrderedDict([
+        ('timestamp', datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('cpu_count', mp.cpu_count()),
+        ('rows', rows),
+        ('conversions', []),
+        ('helpers', OrderedDict())
+    ])
+
+    directory = tempfile.mkdtemp(prefix='cow-bench-')
+    try:
+        for name in scenarios:
+            settings = SCENARIOS[name]
+            logger.info("Generating dataset {} ({} rows)".format(name, rows))
+            csv_file = make_dataset(directory, name, rows, **settings)
+
+            for p in processes:
+                for chunksize in (chunksizes if p > 1 else chunksizes[-1:]):
+                    result = bench_conversion(csv_file, rows, p, chunksize)
+                    result['dataset'] = name
+                    result.update(settings)
+                    results['conversions'].append(result)
+                    logger.info("{dataset}: {mode} ({processes} processes, chunksize {chunksize}): "
+                                "{rows_per_second} rows/s, {triples_per_second} triples/s, peak RSS "
+                                "{peak_rss_parent_kb} KB (largest worker {peak_rss_largest_worker_kb} KB)".format(**result))
+
+            results['helpers'][name] = bench_helpers(csv_file)
+            logger.info("{}: {}".format(name, json.dumps(results['helpers'][name])))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    with open(results_file, 'w') as f:
+        json.dump(results, f, indent=True)
+    logger.info("Wrote benchmark results to {}".format(results_file))
+
+    return results
@@ -0,0 +1,333 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+A compact binary serialization of the quads of a conversion: a dictionary of the terms, and the quads as four term
+ids each, in the spirit of HDT and RDF-Thrift. IRIs that are repeated millions of times in N-Quads (properties,
+code lists, the graph name) are written once, so the files are much smaller and much faster to load.
+
+A file starts with BINARY_MAGIC, followed by blocks of a kind (one byte), the length of the payload (a little-endian
+unsigned 32-bit integer) and the payload:
+
+* ``T`` (terms): the terms that get the next ids, starting at 0 for the first term in the file. Each term is a kind
+  (see TERM_KINDS) and its value (and language tag or datatype IRI), as UTF-8 strings preceded by their length.
+* ``Q`` (quads): the subject, predicate, object and graph ids of the quads, as little-endian unsigned 32-bit integers.
+
+The workers of a conversion number the terms in their own :class:`TermDictionary`, and the
+:class:`DictionaryMerger` in the main process maps these to the ids in the file. Files are read with
+:class:`BinaryRDFReader`. Compressed files are concatenated gzip members, like the other output formats.
+"""
+
+import io
+import sys
+import struct
+import random
+from array import array
+from rdflib import URIRef, BNode, Literal, ConjunctiveGraph
+
+try:
+    # Python 2
+    from util import open_compressed
+except ImportError:
+    from .util import open_compressed
+
+try:
+    # Python 2
+    text_type = unicode
+except NameError:
+    # Python 3
+    text_type = str
+
+# The start of every binary RDF file (the last byte is the version of the format)
+BINARY_MAGIC = b'COWRDF\n\x01'
+
+# The kinds of terms, and the number of strings that follow them
+IRI, BLANK_NODE, LITERAL, LANGUAGE_LITERAL, TYPED_LITERAL = range(5)
+TERM_KINDS = {IRI: 1, BLANK_NODE: 1, LITERAL: 1, LANGUAGE_LITERAL: 2, TYPED_LITERAL: 2}
+
+BLOCK_HEADER = struct.Struct('<cI')
+UINT32 = struct.Struct('<I')
+# The header of a chunk converted by a worker: the token of its dictionary, the id of the first new term,
+# and the number of new terms and quads
+CHUNK_HEADER = struct.Struct('<QIII')
+
+
+def _to_bytes(ids):
+    """Returns an array of unsigned 32-bit integers as little-endian bytes"""
+    if sys.byteorder == 'big':
+        ids = array('I', ids)
+        ids.byteswap()
+    return ids.tobytes() if hasattr(ids, 'tobytes') else ids.tostring()
+
+
+def _from_bytes(data):
+    """Returns an array of unsigned 32-bit integers from little-endian bytes"""
+    ids = array('I')
+    if hasattr(ids, 'frombytes'):
+        ids.frombytes(data)
+    else:
+        ids.fromstring(data)
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return ids
+
+
+def encode_term(term):
+    """Returns the binary representation of an rdflib ``term`` in a terms block"""
+    if isinstance(term, Literal):
+        if term.language:
+            kind, strings = LANGUAGE_LITERAL, (term, term.language)
+        elif term.datatype:
+            kind, strings = TYPED_LITERAL, (term, term.datatype)
+        else:
+            kind, strings = LITERAL, (term,)
+    elif isinstance(term, BNode):
+        kind, strings = BLANK_NODE, (term,)
+    else:
+        kind, strings = IRI, (term,)
+
+    parts = [struct.pack('<B', kind)]
+    for string in strings:
+        encoded = string.encode('utf-8')
+        parts.append(UINT32.pack(len(encoded)))
+        parts.append(encoded)
+    return b''.join(parts)
+
+
+def _iri(value):
+    """Returns a URIRef for ``value`` without validating it again, the converter only writes valid IRIs"""
+    return text_type.__new__(URIRef, value)
+
+
+def decode_terms(data, datatypes=None):
+    """Returns the rdflib terms in the payload of a terms block (using and adding to the cache of ``datatypes``)"""
+    if datatypes is None:
+        datatypes = {}
+    terms = []
+    offset = 0
+    end = len(data)
+    while offset < end:
+        kind = ord(data[offset:offset + 1])
+        offset += 1
+        strings = []
+        for _ in range(TERM_KINDS[kind]):
+            length, = UINT32.unpack_from(data, offset)
+            offset += 4
+            strings.append(data[offset:offset + length].decode('utf-8'))
+            offset += length
+
+        if kind == IRI:
+            terms.append(_iri(strings[0]))
+        elif kind == BLANK_NODE:
+            terms.append(BNode(strings[0]))
+        elif kind == LITERAL:
+            terms.append(Literal(strings[0]))
+        elif kind == LANGUAGE_LITERAL:
+            terms.append(Literal(strings[0], lang=strings[1]))
+        else:
+            datatype = datatypes.get(strings[1])
+            if datatype is None:
+                datatype = datatypes[strings[1]] = _iri(strings[1])
+            terms.append(Literal(strings[0], datatype=datatype, normalize=False))
+    return terms
+
+
+def block(kind, payload):
+    return BLOCK_HEADER.pack(kind, len(payload)) + payload
+
+
+class TermDictionary(object):
+    """
+    The ids of the terms used by a worker process. The terms that were added since the previous chunk are sent
+    to the main process with the chunk (see :meth:`new_terms`), so every term is only encoded and sent once
+    per worker. The random ``token`` tells the dictionaries of the workers apart.
+    """
+
+    def __init__(self):
+        self.token = random.SystemRandom().getrandbits(63)
+        self.ids = {}
+        self._new = []
+        self._first = 0
+
+    def id(self, term):
+        i = self.ids.get(term)
+        if i is None:
+            i = self.ids[term] = len(self.ids)
+            self._new.append(encode_term(term))
+        return i
+
+    def new_terms(self):
+        """Returns the id of the first term added since the previous call, and the encoded terms"""
+        first, new = self._first, self._new
+        self._first = len(self.ids)
+        self._new = []
+        return first, new
+
+
+class DictionaryGraph(object):
+    """
+    A write-only stand-in for an RDFLib graph (like :class:`StreamingGraph`) that numbers the terms of each triple
+    with the ``terms`` dictionary of the worker, and serializes the chunk as the new terms and the quads of ids.
+    Quads can be added for other graphs than ``identifier`` with :meth:`add_quad`.
+    """
+
+    def __init__(self, identifier, terms):
+        self.identifier = identifier
+        self.terms = terms
+        self._graph = terms.id(identifier) if identifier is not None else None
+        self._quads = array('I')
+        self._seen = set()
+
+    def add(self, triple, unique=False):
+        """Adds the (s, p, o) ``triple`` (unless it was added before, and not ``unique``)"""
+        s, p, o = triple
+        self.add_quad(s, p, o, None, unique)
+
+    def add_quad(self, s, p, o, g=None, unique=False):
+        term_id = self.terms.id
+        quad = (term_id(s), term_id(p), term_id(o), self._graph if g is None else term_id(g))
+        if not unique:
+            if quad in self._seen:
+                return
+            self._seen.add(quad)
+        self._quads.extend(quad)
+
+    def __len__(self):
+        return len(self._quads) // 4
+
+    def serialize(self, format=None):
+        """Returns the new terms and the quads as a chunk for the :class:`DictionaryMerger`"""
+        first, new = self.terms.new_terms()
+        lengths = array('I', [len(t) for t in new])
+        return b''.join([CHUNK_HEADER.pack(self.terms.token, first, len(new), len(self)),
+                         _to_bytes(lengths)] + new + [_to_bytes(self._quads)])
+
+
+class DictionaryMerger(object):
+    """
+    Merges the term dictionaries of the workers into the dictionary of the binary RDF file, and turns their chunks
+    (see :meth:`DictionaryGraph.serialize`) into a block of the terms that are new in the file and a block of quads.
+    The chunks of each worker should be merged in the order the worker converted them.
+    """
+
+    def __init__(self):
+        # The file ids of the encoded terms
+        self.ids = {}
+        # For each worker dictionary, the file id of each of its ids
+        self.workers = {}
+
+    def load(self, file_name):
+        """Adds the terms of an existing (e.g. partially written) binary RDF file to the dictionary"""
+        for kind, payload in BinaryRDFReader(file_name).blocks(quads=False):
+            for term in _split_terms(payload):
+                self.ids[term] = len(self.ids)
+
+    def merge(self, chunk):
+        """Returns the terms and quads blocks for the ``chunk`` of a worker"""
+        token, first, count, quads = CHUNK_HEADER.unpack_from(chunk)
+        offset = CHUNK_HEADER.size
+        lengths = _from_bytes(chunk[offset:offset + 4 * count])
+        offset += 4 * count
+
+        mapping = self.workers.setdefault(token, [])
+        if first != len(mapping):
+            raise Exception("Cannot merge a chunk with term {} of a worker, expected term {}".format(first, len(mapping)))
+
+        ids = self.ids
+        new = []
+        for length in lengths:
+            term = chunk[offset:offset + length]
+            offset += length
+            i = ids.get(term)
+            if i is None:
+                i = ids[term] = len(ids)
+                new.append(term)
+            mapping.append(i)
+
+        output = []
+        if new:
+            output.append(block(b'T', b''.join(new)))
+        if quads:
+            output.append(block(b'Q', _to_bytes(array('I', [mapping[i] for i in _from_bytes(chunk[offset:])]))))
+        return b''.join(output)
+
+    def encode(self, quads):
+        """Returns the blocks for the rdflib (s, p, o, g) ``quads`` (e.g. of the nanopublication)"""
+        g = DictionaryGraph(None, TermDictionary())
+        for s, p, o, graph in quads:
+            g.add_quad(s, p, o, graph)
+        return self.merge(g.serialize())
+
+
+def _split_terms(payload):
+    """Returns the encoded terms in the payload of a terms block, without decoding them"""
+    terms = []
+    offset = 0
+    end = len(payload)
+    while offset < end:
+        start = offset
+        kind = ord(payload[offset:offset + 1])
+        offset += 1
+        for _ in range(TERM_KINDS[kind]):
+            length, = UINT32.unpack_from(payload, offset)
+            offset += 4 + length
+        terms.append(payload[start:offset])
+    return terms
+
+
+class BinaryRDFReader(object):
+    """
+    Streams the quads of the binary RDF file ``file_name`` (compressed or not) as tuples of rdflib terms:
+
+        for s, p, o, g in BinaryRDFReader('myfile.csv.rdfb'):
+            ...
+
+    Only the terms dictionary is kept in memory, the quads are read a block at a time.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.terms = []
+
+    def __iter__(self):
+        return self.quads()
+
+    def blocks(self, quads=True):
+        """Yields the kind and payload of every block, skipping the payloads of the quads blocks unless ``quads``"""
+        with open_compressed(self.file_name) as f:
+            if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+                raise Exception("{} is not a binary RDF file".format(self.file_name))
+            while True:
+                header = f.read(BLOCK_HEADER.size)
+                if not header:
+                    return
+                if len(header) < BLOCK_HEADER.size:
+                    raise Exception("{} ends in the middle of a block".format(self.file_name))
+                kind, length = BLOCK_HEADER.unpack(header)
+                if kind == b'Q' and not quads:
+                    f.seek(length, io.SEEK_CUR)
+                    continue
+                payload = f.read(length)
+                if len(payload) < length:
+                    raise Exception("{} ends in the middle of a block".format(self.file_name))
+                yield kind, payload
+
+    def quads(self):
+        """Yields the (s, p, o, g) quads in the file, as rdflib terms"""
+        self.terms = terms = []
+        datatypes = {}
+        for kind, payload in self.blocks():
+            if kind == b'T':
+                terms.extend(decode_terms(payload, datatypes))
+            elif kind == b'Q':
+                ids = _from_bytes(payload)
+                for s, p, o, g in zip(ids[0::4], ids[1::4], ids[2::4], ids[3::4]):
+                    yield terms[s], terms[p], terms[o], terms[g]
+
+    def graph(self, graph=None):
+        """Returns a ConjunctiveGraph (or adds to the given ``graph``) with the quads in the file"""
+        if graph is None:
+            graph = ConjunctiveGraph()
+        for s, p, o, g in self.quads():
+            graph.get_context(g).add((s, p, o))
+        return graph
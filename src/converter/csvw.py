@@ -2,9 +2,11 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
 import datetime
 import json
 import logging
+import string
 import iribaker
 import traceback
 import rfc3987
@@ -14,24 +16,57 @@ import unicodecsv as csv
 from jinja2 import Template
 try:
     # Python 2
-    from util import get_namespaces, Nanopublication, CSVW, PROV, DC, SKOS, RDF
+    from util import get_namespaces, save_namespaces, prefix_header, Nanopublication, SourceHash, git_hash_file, compression, strip_compression, open_compressed, gzip_member, HyperLogLog, StreamingGraph, quote_term, quote_lexical, STREAMING_FORMATS, LINE_FORMATS, CSVW, PROV, DC, SKOS, RDF
+    from upload import GraphStoreUploader
+    from binary import BINARY_MAGIC, TermDictionary, DictionaryGraph, DictionaryMerger
 except ImportError:
-    from .util import get_namespaces, Nanopublication, CSVW, PROV, DC, SKOS, RDF
+    from .util import get_namespaces, save_namespaces, prefix_header, Nanopublication, SourceHash, git_hash_file, compression, strip_compression, open_compressed, gzip_member, HyperLogLog, StreamingGraph, quote_term, quote_lexical, STREAMING_FORMATS, LINE_FORMATS, CSVW, PROV, DC, SKOS, RDF
+    from .upload import GraphStoreUploader
+    from .binary import BINARY_MAGIC, TermDictionary, DictionaryGraph, DictionaryMerger
 from rdflib import URIRef, Literal, Graph, BNode, XSD, Dataset
 from rdflib.resource import Resource
 from rdflib.collection import Collection
-from functools import partial
+from collections import OrderedDict
 try:
     # Python 3
     from itertools import zip_longest
 except ImportError:
     # Python 2
     from itertools import izip_longest as zip_longest
+from itertools import islice
+from functools import partial
+try:
+    # Python 3
+    from queue import Queue
+except ImportError:
+    # Python 2
+    from Queue import Queue
 
 import io
+import mmap
+import uuid
+import pickle
+import threading
+import codecs
+import shutil
+import tempfile
+import timeit
+import pstats
+import cProfile
+from contextlib import contextmanager
+try:
+    # Python 3
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
 
-# Python 2 and 3 compatible unicode
-# from builtins import str
+try:
+    # Python 2
+    text_type = unicode
+except NameError:
+    # Python 3
+    text_type = str
 
 
 logger = logging.getLogger(__name__)
@@ -39,14 +74,123 @@ logger.setLevel(logging.DEBUG)
 
 
 # Serialization extension dictionary
-extensions = {'xml': 'xml', 'n3' : 'n3', 'turtle': 'ttl', 'nt' : 'nt', 'pretty-xml' : 'xml', 'trix' : 'trix', 'trig' : 'trig', 'nquads' : 'nq'}
+extensions = {'xml': 'xml', 'n3' : 'n3', 'turtle': 'ttl', 'nt' : 'nt', 'pretty-xml' : 'xml', 'trix' : 'trix', 'trig' : 'trig', 'nquads' : 'nq', 'binary' : 'rdfb'}
+
 
+# Number of bytes sampled from a CSV file to detect its encoding and delimiter
+SAMPLE_SIZE = 96 * 1024
 
-def build_schema(infile, outfile, delimiter=None, quotechar='\"', encoding=None, dataset_name=None, base="https://iisg.amsterdam/"):
+# Delimiters considered when sniffing the dialect of a CSV file
+SNIFF_DELIMITERS = ',;\t|'
+
+
+def sample_file(infile, sample_size=SAMPLE_SIZE):
+    """
+    Returns a list of byte strings sampled from the head, middle and tail of ``infile``, together
+    at most ``sample_size`` bytes. Samples other than the head start and end at line boundaries.
+    Files that are smaller than ``sample_size`` are returned as a single sample.
+    Compressed files cannot be sampled at random offsets, so only their head is sampled.
+    """
+    if compression(infile) is not None:
+        with open_compressed(infile) as f:
+            sample = f.read(sample_size)
+            if f.read(1):
+                # Drop the partial line at the end of the sample
+                sample = sample[:sample.rfind(b'\n') + 1]
+            return [sample]
+
+    size = os.path.getsize(infile)
+    with open(infile, 'rb') as f:
+        if size <= sample_size:
+            return [f.read()]
+
+        part = sample_size // 3
+        samples = []
+        for offset in (0, (size - part) // 2, size - part):
+            f.seek(offset)
+            sample = f.read(part)
+            if offset > 0:
+                # Skip the (partial) line we landed in
+                sample = sample[sample.find(b'\n') + 1:]
+            if offset + part < size:
+                # Drop the partial line at the end of the sample
+                sample = sample[:sample.rfind(b'\n') + 1]
+            samples.append(sample)
+        return samples
+
+
+def detect_encoding(samples):
+    """Feeds the ``samples`` to chardet, and returns the detected encoding and its confidence"""
+    detector = UniversalDetector()
+    for sample in samples:
+        for line in sample.splitlines(True):
+            detector.feed(line)
+            if detector.done:
+                break
+        if detector.done:
+            break
+    detector.close()
+    return detector.result['encoding'], detector.result['confidence']
+
+
+def detect_delimiter(samples, encoding=None, quotechar='\"'):
+    """
+    Sniffs the delimiter from the first sample (the head of the file). Returns the delimiter, and as
+    confidence the fraction of sampled rows that have as many fields as the header.
+    """
+    try:
+        codecs.lookup(encoding)
+    except (LookupError, TypeError):
+        encoding = 'utf-8'
+
+    head = samples[0]
+    if len(head) == 0:
+        return ',', 0.0
+
+    if str is bytes:
+        # Python 2: the csv module works on byte strings
+        sample = head
+    else:
+        sample = head.decode(encoding, 'ignore')
+
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=SNIFF_DELIMITERS)
+        delimiter = str(dialect.delimiter)
+    except csv.Error:
+        # For instance, a file with a single column
+        logger.warning("Could not determine the delimiter, assuming ','")
+        delimiter = ','
+
+    # Compare the number of fields of the sampled rows to that of the header
+    rows = 0
+    matches = 0
+    width = None
+    try:
+        for sample in samples:
+            for row in csv.reader(io.BytesIO(sample), delimiter=delimiter, quotechar=quotechar, encoding=encoding, errors='ignore'):
+                if width is None:
+                    width = len(row)
+                    continue
+                rows += 1
+                if len(row) == width:
+                    matches += 1
+    except csv.Error as e:
+        logger.debug("Could not parse sample: {}".format(e))
+
+    if rows == 0:
+        return delimiter, 0.0
+    return delimiter, round(float(matches) / rows, 2)
+
+
+def build_schema(infile, outfile, delimiter=None, quotechar='\"', encoding=None, dataset_name=None, base="https://iisg.amsterdam/", persist_namespaces=False, sample_size=SAMPLE_SIZE, profile=False, processes=4, chunksize=5000):
     """
     Build a CSVW schema based on the ``infile`` CSV file, and write the resulting JSON CSVW schema to ``outfile``.
+    If ``persist_namespaces`` is set, the namespaces for ``base`` are also stored in namespaces.yaml.
+    If ``profile`` is set, the columns are profiled (see :func:`profile_csv`) in ``processes`` processes, to
+    infer their datatypes, null values and number of distinct values.
 
     Takes various optional parameters for instructing the CSV reader, but is also quite good at guessing the right values.
+    The encoding and delimiter are guessed from at most ``sample_size`` bytes of the file (see :func:`sample_file`).
     """
 
     url = os.path.basename(infile)
@@ -56,44 +200,32 @@ def build_schema(infile, outfile, delimiter=None, quotechar='\"', encoding=None,
     if dataset_name is None:
         dataset_name = url
 
+    if encoding is None or delimiter is None:
+        samples = sample_file(infile, sample_size)
+
     if encoding is None:
-        detector = UniversalDetector()
-        with open(infile, 'rb') as f:
-            for line in f.readlines():
-                detector.feed(line)
-                if detector.done:
-                    break
-        detector.close()
-        encoding = detector.result['encoding']
-        logger.info("Detected encoding: {} ({} confidence)".format(detector.result['encoding'],
-                                                                   detector.result['confidence']))
+        encoding, confidence = detect_encoding(samples)
+        logger.info("Detected encoding: {} ({} confidence)".format(encoding, confidence))
 
     if delimiter is None:
-        try: #Python 3
-            with open(infile, 'r', errors='ignore') as csvfile:
-                # dialect = csv.Sniffer().sniff(csvfile.read(1024), delimiters=";,$\t")
-                dialect = csv.Sniffer().sniff(csvfile.readline()) #read only the header instead of the entire file to determine delimiter
-                csvfile.seek(0)
-        except TypeError: #Python 2
-            with open(infile, 'r') as csvfile:
-                # dialect = csv.Sniffer().sniff(csvfile.read(1024), delimiters=";,$\t")
-                dialect = csv.Sniffer().sniff(csvfile.readline()) #read only the header instead of the entire file to determine delimiter
-                csvfile.seek(0)
-        logger.info("Detected dialect: {} (delimiter: '{}')".format(dialect, dialect.delimiter))
-        delimiter = dialect.delimiter
-
+        delimiter, confidence = detect_delimiter(samples, encoding, quotechar)
+        logger.info("Detected delimiter: '{}' ({} confidence)".format(delimiter, confidence))
 
     logger.info("Delimiter is: {}".format(delimiter))
 
     if base.endswith('/'):
         base = base[:-1]
 
+    namespaces = get_namespaces(base)
+    if persist_namespaces:
+        save_namespaces(namespaces)
+
     metadata = {
         u"@id": iribaker.to_iri(u"{}/{}".format(base, url)),
         u"@context": [u"https://raw.githubusercontent.com/CLARIAH/COW/master/csvw.json",
                      {u"@language": u"en",
                       u"@base": u"{}/".format(base)},
-                     get_namespaces(base)],
+                     dict(namespaces)],
         u"url": url,
         u"dialect": {u"delimiter": delimiter,
                     u"encoding": encoding,
@@ -114,7 +246,7 @@ def build_schema(infile, outfile, delimiter=None, quotechar='\"', encoding=None,
         }
     }
 
-    with io.open(infile, 'rb') as infile_file:
+    with open_compressed(infile) as infile_file:
         r = csv.reader(infile_file, delimiter=delimiter, quotechar=quotechar)
 
         try:
@@ -134,7 +266,11 @@ def build_schema(infile, outfile, delimiter=None, quotechar='\"', encoding=None,
         # First column is primary key
         metadata[u'tableSchema'][u'primaryKey'] = header[0]
 
-        for head in header:
+        profiles = None
+        if profile:
+            profiles = profile_csv(infile, len(header), encoding, delimiter, quotechar, processes, chunksize)
+
+        for i, head in enumerate(header):
             col = {
                 u"@id": iribaker.to_iri(u"{}/{}/column/{}".format(base, url, head)),
                 u"name": head,
@@ -142,6 +278,8 @@ def build_schema(infile, outfile, delimiter=None, quotechar='\"', encoding=None,
                 u"dc:description": head,
                 u"datatype": u"string"
             }
+            if profiles is not None:
+                col.update(profiles[i].annotations())
 
             metadata[u'tableSchema'][u'columns'].append(col)
 
@@ -152,6 +290,185 @@ def build_schema(infile, outfile, delimiter=None, quotechar='\"', encoding=None,
     return
 
 
+# Values that are commonly used to indicate a missing value
+NULL_TOKENS = frozenset([u'NA', u'N/A', u'n/a', u'NULL', u'null', u'None', u'NaN', u'nan', u'-', u'.', u'?', u'#N/A',
+                         u'missing', u'unknown'])
+
+# The datatypes inferred when profiling columns, from the most to the least specific. Integers
+# with leading zeros are not considered numbers, as they are usually identifiers or codes.
+DATATYPE_PATTERNS = OrderedDict([
+    (u'boolean', re.compile(r'^(true|false)$')),
+    (u'integer', re.compile(r'^[+-]?(0|[1-9][0-9]*)$')),
+    (u'decimal', re.compile(r'^[+-]?((0|[1-9][0-9]*)(\.[0-9]*)?|\.[0-9]+)$')),
+    (u'double', re.compile(r'^[+-]?((0|[1-9][0-9]*)(\.[0-9]*)?|\.[0-9]+)([eE][+-]?[0-9]+)?$')),
+    (u'date', re.compile(r'^-?[0-9]{4}-[0-9]{2}-[0-9]{2}(Z|[+-][0-9]{2}:[0-9]{2})?$')),
+    (u'dateTime', re.compile(r'^-?[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]+)?(Z|[+-][0-9]{2}:[0-9]{2})?$'))
+])
+
+# Columns with at most this many distinct values, each occurring at least CODED_MIN_FREQUENCY times on
+# average, are reported as likely to be coded
+CODED_MAX_VALUES = 50
+CODED_MIN_FREQUENCY = 5
+
+
+class ColumnProfile(object):
+    """
+    Keeps statistics on the values of a column in constant memory: the number of (empty) values, the null
+    tokens used, the datatypes that all other values are valid for, an estimate of the number of distinct values,
+    and the frequencies of the values as long as there are at most ``CODED_MAX_VALUES`` of them.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.empty = 0
+        self.nulls = {}
+        self.datatypes = set(DATATYPE_PATTERNS)
+        self.frequencies = {}
+        self.distinct = HyperLogLog()
+
+    def add(self, value):
+        self.count += 1
+        if len(value) == 0:
+            self.empty += 1
+            return
+        if value in NULL_TOKENS:
+            self.nulls[value] = self.nulls.get(value, 0) + 1
+            return
+
+        for datatype in list(self.datatypes):
+            if not DATATYPE_PATTERNS[datatype].match(value):
+                self.datatypes.discard(datatype)
+
+        self.distinct.add(value)
+        if self.frequencies is not None:
+            self.frequencies[value] = self.frequencies.get(value, 0) + 1
+            if len(self.frequencies) > CODED_MAX_VALUES:
+                self.frequencies = None
+
+    def merge(self, other):
+        """Merges the statistics of the ``other`` profile (of the same column) into this one"""
+        self.count += other.count
+        self.empty += other.empty
+        for token, n in other.nulls.items():
+            self.nulls[token] = self.nulls.get(token, 0) + n
+        self.datatypes &= other.datatypes
+        self.distinct.merge(other.distinct)
+        if self.frequencies is not None and other.frequencies is not None:
+            for value, n in other.frequencies.items():
+                self.frequencies[value] = self.frequencies.get(value, 0) + n
+            if len(self.frequencies) > CODED_MAX_VALUES:
+                self.frequencies = None
+        else:
+            self.frequencies = None
+
+    @property
+    def values(self):
+        """The number of values that are neither empty nor a null token"""
+        return self.count - self.empty - sum(self.nulls.values())
+
+    def datatype(self):
+        """The most specific datatype that is valid for all values (or ``string``)"""
+        if self.values == 0:
+            return u'string'
+        for datatype in DATATYPE_PATTERNS:
+            if datatype in self.datatypes:
+                return datatype
+        return u'string'
+
+    def distinct_count(self):
+        """The number of distinct values (exact for small numbers of distinct values, otherwise an estimate)"""
+        if self.frequencies is not None:
+            return len(self.frequencies)
+        return len(self.distinct)
+
+    def is_coded(self):
+        return (self.frequencies is not None and self.datatype() != u'boolean' and
+                0 < len(self.frequencies) * CODED_MIN_FREQUENCY <= self.values)
+
+    def annotations(self):
+        """Returns the CSVW column properties (and annotations) derived from the profile"""
+        distinct = self.distinct_count()
+        annotations = {
+            u"datatype": self.datatype(),
+            u"void:distinctObjects": distinct
+        }
+        if self.nulls:
+            # The most frequent null tokens first
+            annotations[u"null"] = sorted(self.nulls, key=lambda token: (-self.nulls[token], token))
+        if self.is_coded():
+            annotations[u"rdfs:comment"] = u"Likely coded: {} distinct values in {} rows".format(distinct, self.values)
+        return annotations
+
+
+def profile_csv(infile, width, encoding='utf-8', delimiter=',', quotechar='\"', processes=4, chunksize=5000):
+    """
+    Profiles the ``width`` columns of the ``infile`` CSV file in a single pass, and returns a list of
+    :class:`ColumnProfile` instances. With more than one process (and an encoding that allows it, see
+    :func:`shardable`), the processes each profile their own byte ranges of the file, unless it is compressed.
+    """
+    logger.info("Profiling columns of {}".format(infile))
+    if processes > 1 and shardable(encoding) and compression(infile) is None:
+        with CSVShards(infile, chunksize, encoding, delimiter, quotechar) as shards:
+            source = {'file_name': infile,
+                      'width': width,
+                      'encoding': encoding,
+                      'delimiter': delimiter,
+                      'quotechar': quotechar}
+            pool = mp.Pool(processes=processes, initializer=_initProfiler, initargs=(source,))
+            profiles = None
+            for chunk_profiles in pool.imap_unordered(_profileChunk, shards):
+                if profiles is None:
+                    profiles = chunk_profiles
+                else:
+                    for profile, chunk_profile in zip(profiles, chunk_profiles):
+                        profile.merge(chunk_profile)
+            pool.close()
+            pool.join()
+        if profiles is None:
+            profiles = [ColumnProfile() for _ in range(width)]
+    else:
+        with open_compressed(infile) as csvfile:
+            reader = csv.reader(csvfile, encoding=encoding, delimiter=delimiter, quotechar=quotechar)
+            # Skip the header
+            next(reader, None)
+            profiles = _profile_rows(reader, width)
+
+    for profile in profiles:
+        logger.debug("{} values, datatype {}, {} distinct values".format(
+            profile.count, profile.datatype(), profile.distinct_count()))
+    return profiles
+
+
+def _profile_rows(rows, width):
+    """Profiles the first ``width`` fields of the ``rows``"""
+    profiles = [ColumnProfile() for _ in range(width)]
+    for row in rows:
+        for profile, value in zip(profiles, row):
+            profile.add(value)
+    return profiles
+
+
+# The source file and dialect of a profiling process, set once by _initProfiler
+_profiler_state = {}
+
+
+def _initProfiler(source):
+    _profiler_state.update(source)
+
+
+def _profileChunk(shard):
+    """Profiles an (offset, length, first_row) byte range of the source file, see :func:`profile_csv`"""
+    offset, length, _ = shard
+    state = _profiler_state
+    with open(state['file_name'], 'rb') as csvfile:
+        csvfile.seek(offset)
+        reader = csv.reader(io.BytesIO(csvfile.read(length)),
+                            encoding=state['encoding'],
+                            delimiter=state['delimiter'],
+                            quotechar=state['quotechar'])
+        return _profile_rows(reader, state['width'])
+
+
 class Item(Resource):
     """Wrapper for the rdflib.resource.Resource class that allows getting property values from resources."""
 
@@ -179,6 +496,280 @@ class Item(Resource):
         return URIRef(self._graph.store.namespace(pfx) + name)
 
 
+# Markers of Jinja statements, expressions and comments
+JINJA_MARKERS = (u'{{', u'{%', u'{#')
+
+
+class ConstantPattern(object):
+    """A pattern without any placeholders, it renders to itself"""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def __call__(self, row):
+        return self.pattern
+
+
+class FormatPattern(object):
+    """A pattern with only Python ``{column}`` placeholders, rendered without involving Jinja"""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.parts = []
+        self.simple = True
+        for literal, field, spec, conversion in string.Formatter().parse(pattern):
+            if field is None:
+                self.parts.append((literal, None))
+            elif field == u'' or field.isdigit() or u'.' in field or u'[' in field or spec or conversion:
+                # Let str.format deal with attribute access, indexing and format specifications
+                self.simple = False
+            else:
+                self.parts.append((literal, field))
+
+    def __call__(self, row):
+        try:
+            if not self.simple:
+                return self.pattern.format(**row)
+            return u''.join([literal if field is None else literal + text_type(row[field])
+                             for literal, field in self.parts])
+        except:
+            logger.warning(
+                u"Could not apply python string formatting, probably due to mismatched curly brackets. IRI will be '{}'. ".format(self.pattern))
+            return self.pattern
+
+
+class JinjaPattern(object):
+    """A Jinja template (using filters, expressions or statements), of which the result is formatted using the Python ``{column}`` placeholders"""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.template = Template(pattern)
+
+    def __getstate__(self):
+        # Jinja templates cannot be pickled, they are compiled again in the worker
+        return {'pattern': self.pattern}
+
+    def __setstate__(self, state):
+        self.__init__(state['pattern'])
+
+    def __call__(self, row):
+        rendered_template = self.template.render(**row)
+
+        try:
+            # We then format the resulting string using the standard Python2
+            # expressions
+            return rendered_template.format(**row)
+        except:
+            logger.warning(
+                u"Could not apply python string formatting, probably due to mismatched curly brackets. IRI will be '{}'. ".format(rendered_template))
+            return rendered_template
+
+
+def compile_pattern(pattern):
+    """Compiles an aboutUrl, propertyUrl, valueUrl (or csvw:value, lang) ``pattern`` into the cheapest callable that
+    renders it for a row: a :class:`ConstantPattern`, :class:`FormatPattern` or :class:`JinjaPattern`"""
+    if pattern is None:
+        return None
+
+    # Jinja drops a trailing newline, so leave those patterns to Jinja as well
+    if any(marker in pattern for marker in JINJA_MARKERS) or pattern.endswith(u'\n'):
+        return JinjaPattern(pattern)
+
+    if u'{' not in pattern and u'}' not in pattern:
+        return ConstantPattern(pattern)
+
+    try:
+        return FormatPattern(pattern)
+    except ValueError:
+        logger.warning(
+            u"Could not parse python string formatting, probably due to mismatched curly brackets. IRI will be '{}'. ".format(pattern))
+        return ConstantPattern(pattern)
+
+
+class ColumnPlan(object):
+    """Plain, picklable description of how a single CSVW column is converted.
+
+    All values are resolved from the metadata graph once (see :func:`compile_schema`), so that the
+    :class:`BurstConverter` does not have to query the graph for every cell of every row.
+    """
+
+    def __init__(self, identifier=None, name=None, virtual=False, about_url=None, property_url=None,
+                 value_url=None, value=None, datatype=None, lang=None, collection_url=None, scheme_url=None,
+                 nulls=frozenset(), null_conditions=(), parse_on_empty=False):
+        # The @id of the column (only if it is a proper URI), used for provenance
+        self.identifier = identifier
+        self.name = name
+        self.virtual = virtual
+        # Jinja/Python format patterns (compiled, see compile_pattern)
+        self.about_url = compile_pattern(about_url)
+        self.property_url = compile_pattern(property_url)
+        self.value_url = compile_pattern(value_url)
+        self.value = compile_pattern(value)
+        self.lang = compile_pattern(lang)
+        self.collection_url = compile_pattern(collection_url)
+        self.scheme_url = compile_pattern(scheme_url)
+        # The resolved datatype URIRef (or None for plain literals)
+        self.datatype = datatype
+        # Cell values that should be treated as 'null' (skipped)
+        self.nulls = nulls
+        # (column name, value) pairs: the cell is skipped when one of these matches the row
+        self.null_conditions = null_conditions
+        self.parse_on_empty = parse_on_empty
+
+        self.is_uri = datatype == XSD.anyURI
+        self.is_link = datatype == XSD.linkURI
+        self.has_lang = datatype == XSD.string and lang is not None
+
+        # The linkURI special case only uses the template part of the about and value URLs
+        self.link_about_url = None
+        self.link_value_url = None
+        if self.is_link:
+            self.link_about_url = compile_pattern(_template_part(about_url))
+            self.link_value_url = compile_pattern(_template_part(value_url))
+
+
+class SchemaPlan(object):
+    """Plain, picklable description of a CSVW tableSchema: the default aboutUrl and a list of :class:`ColumnPlan` objects."""
+
+    def __init__(self, about_url, columns):
+        self.about_url = compile_pattern(about_url)
+        self.columns = columns
+
+
+def _template_part(pattern):
+    """Returns the first ``{...}`` part of the pattern (or None if there is no pattern)"""
+    if pattern is None:
+        return None
+    return pattern[pattern.find("{"):pattern.find("}") + 1]
+
+
+def _text(graph, subject, predicate):
+    """Returns the (first) object of ``subject`` and ``predicate`` as a string, or None if there is none"""
+    o = graph.value(subject, predicate, any=True)
+    if o is None:
+        return None
+    return text_type(o)
+
+
+def _null_specification(graph, subject):
+    """Collects the null values of the ``subject`` (a column or schema).
+
+    Returns a set of literal null values, and a list of (column name, null value) conditions for
+    null specifications that refer to another column."""
+    nulls = set()
+    conditions = []
+    for o in graph.objects(subject, CSVW['null']):
+        if isinstance(o, Literal):
+            nulls.add(text_type(o))
+            continue
+
+        # An RDF list of null specifications, or a single specification
+        if graph.value(o, RDF.first) is not None:
+            members = list(Collection(graph, o))
+        else:
+            members = [o]
+
+        for m in members:
+            if isinstance(m, Literal):
+                nulls.add(text_type(m))
+            else:
+                name = _text(graph, m, CSVW['name'])
+                value = _text(graph, m, CSVW['null'])
+                if name is not None and value is not None:
+                    conditions.append((name, value))
+
+    return nulls, conditions
+
+
+def compile_schema(metadata_graph, schema):
+    """Compiles the CSVW ``schema`` (a tableSchema node in ``metadata_graph``) into a :class:`SchemaPlan`"""
+
+    schema_nulls, _ = _null_specification(metadata_graph, schema)
+
+    # The fallback for columns without a propertyUrl
+    default_namespace = dict(metadata_graph.namespaces()).get('', get_namespaces()['sdv'])
+
+    column_list = metadata_graph.value(schema, CSVW['column'])
+    if column_list is None:
+        logger.warning("No columns found in the tableSchema")
+        column_nodes = []
+    else:
+        column_nodes = list(Collection(metadata_graph, column_list))
+
+    columns = []
+    for c in column_nodes:
+        name = _text(metadata_graph, c, CSVW['name'])
+        nulls, conditions = _null_specification(metadata_graph, c)
+
+        property_url = _text(metadata_graph, c, CSVW['propertyUrl'])
+        if property_url is None and name is not None:
+            property_url = u"{}{}".format(default_namespace, name)
+
+        datatype = metadata_graph.value(c, CSVW['datatype'])
+        if isinstance(datatype, BNode):
+            # A derived datatype, e.g. {"base": "string", "format": "..."}
+            datatype = metadata_graph.value(datatype, CSVW['base'])
+        if datatype is not None:
+            datatype = URIRef(datatype)
+
+        columns.append(ColumnPlan(
+            identifier=c if isinstance(c, URIRef) else None,
+            name=name,
+            virtual=_text(metadata_graph, c, CSVW['virtual']) == u'true',
+            about_url=_text(metadata_graph, c, CSVW['aboutUrl']),
+            property_url=property_url,
+            value_url=_text(metadata_graph, c, CSVW['valueUrl']),
+            value=_text(metadata_graph, c, CSVW['value']),
+            datatype=datatype,
+            lang=_text(metadata_graph, c, CSVW['lang']),
+            collection_url=_text(metadata_graph, c, CSVW['collectionUrl']),
+            scheme_url=_text(metadata_graph, c, CSVW['schemeUrl']),
+            nulls=frozenset(nulls | schema_nulls),
+            null_conditions=tuple(conditions),
+            parse_on_empty=_text(metadata_graph, c, CSVW['parseOnEmpty']) == u'true'))
+
+    return SchemaPlan(_text(metadata_graph, schema, CSVW['aboutUrl']), columns)
+
+
+# The schemas loaded by this process (see load_schema), by file name and hash
+_schemas = OrderedDict()
+_schemas_lock = threading.Lock()
+SCHEMA_CACHE_SIZE = 64
+
+
+def load_schema(schema_file_name, schema_hash):
+    """Returns a copy of the metadata graph of the JSON-LD schema ``schema_file_name`` (with git hash ``schema_hash``),
+    and the cache entry of the schema, with its compiled 'plan' (or None, if it was not compiled yet). A schema file
+    is only parsed once by a process that converts it more than once, such as the jobs of a ConversionService
+    (and again if it changed). The cache is keyed by the file, as relative IRIs can be resolved against its location."""
+    key = (os.path.abspath(schema_file_name), schema_hash)
+    with _schemas_lock:
+        entry = _schemas.get(key)
+    if entry is None:
+        graph = Graph()
+        with open(schema_file_name, 'rb') as f:
+            try:
+                graph.load(f, format='json-ld')
+            except ValueError as err:
+                raise ValueError("{} ; please check the syntax of your JSON-LD schema file".format(err))
+        entry = {'graph': graph, 'plan': None}
+    else:
+        logger.info("Using the schema {} loaded before".format(schema_file_name))
+    with _schemas_lock:
+        # Conversions in other threads may have loaded the schema as well
+        entry = _schemas.pop(key, entry)
+        while len(_schemas) >= SCHEMA_CACHE_SIZE:
+            _schemas.popitem(last=False)
+        _schemas[key] = entry
+
+    # Every conversion gets its own copy, as convert_info() changes the graph
+    metadata_graph = Graph()
+    for prefix, namespace in entry['graph'].namespaces():
+        metadata_graph.bind(prefix, namespace, override=True)
+    metadata_graph += entry['graph']
+    return metadata_graph, entry
+
+
 class CSVWConverter(object):
     """
     Converter configuration object for **CSVW**-style conversion. Is used to set parameters for a conversion,
@@ -190,31 +781,93 @@ class CSVWConverter(object):
     * A nanopublication structure for publishing the converted data (using :class:`converter.util.Nanopublication`)
     """
 
-    def __init__(self, file_name, delimiter=',', quotechar='\"', encoding='utf-8', processes=4, chunksize=5000, output_format='nquads'):
+    def __init__(self, file_name, delimiter=',', quotechar='\"', encoding='utf-8', processes=4, chunksize=5000, output_format='nquads', iri_cache_size=100000, sharded=False, unordered=False, completion_order=False, force=False, resume=False, profile=False, profiler=None, in_flight=None, compress=False, engine='row', write_queue=16, fsync=False, upload=None, pool=None, schema=None):
         logger.info("Initializing converter for {}".format(file_name))
         self.file_name = file_name
         self.output_format = output_format
-        self.target_file = self.file_name + '.' + extensions[self.output_format]
-        schema_file_name = file_name + '-metadata.json'
+        # Compressed source files share their schema and output with the uncompressed file
+        self.target_file = strip_compression(self.file_name) + '.' + extensions[self.output_format]
+        if compress:
+            # Every chunk is written as a separate gzip member
+            self.target_file += '.gz'
+        # The manifest records what the target file was converted from, see convert()
+        self.manifest_file = self.target_file + '.manifest.json'
+        # The checkpoint logs the chunks written by a parallel conversion, so that it can be resumed
+        self.checkpoint_file = self.target_file + '.checkpoint'
+        # The timings of the conversion stages, see write_profile()
+        self.profile_file = self.target_file + '.profile.json'
+        # The schema can be given, e.g. for files that are not stored next to it (see ConversionService)
+        schema_file_name = schema or strip_compression(file_name) + '-metadata.json'
 
         if not os.path.exists(schema_file_name) or not os.path.exists(file_name):
             raise Exception(
                 "Could not find source or metadata file in path; make sure you called with a .csv file")
 
         self._processes = processes
+        # A ConversionPool shared with the conversions of other files, instead of a pool for this conversion
+        self._pool = pool
+        # Identifies this conversion to the workers, see _initWorker
+        self._key = uuid.uuid4().hex
         self._chunksize = chunksize
+        self._iri_cache_size = iri_cache_size
+        self._sharded = sharded
+        # Chunks that complete out of order are spilled to disk, and written in file order unless completion_order is set
+        self._unordered = unordered or completion_order
+        self._completion_order = completion_order
+        self._force = force
+        self._compress = compress
+        # The 'columnar' engine converts simple columns a column at a time, see ColumnarConverter
+        self._engine = engine
+        # The converted chunks are written by an AsyncWriter, see write_chunks()
+        self._write_queue = write_queue
+        self._fsync = fsync
+        # The settings of the GraphStoreUploader that uploads the converted chunks to a triple store, if any
+        self._upload = upload
+        if upload is not None and output_format not in LINE_FORMATS:
+            logger.warning("Can only upload N-Quads or N-Triples conversions, not uploading the {} output".format(output_format))
+            self._upload = None
+        # The term dictionaries of the workers are merged into the dictionary of a binary output file
+        self._merger = None
+        if output_format == 'binary':
+            self._merger = DictionaryMerger()
+            if self._unordered:
+                # The chunks of each worker have to be merged in the order the worker converted them
+                logger.warning("Cannot write binary output out of order, writing the chunks in file order")
+                self._unordered = self._completion_order = False
+        # The number of chunks that are read but not yet converted (and written) is bounded, so that
+        # the pool does not read the CSV file faster than the workers convert it
+        self._in_flight = in_flight or 2 * processes
+        # Profiling with cProfile or tracemalloc implies profiling the conversion stages
+        self._profile = None
+        if profile or profiler:
+            self._profile = ConversionProfile(profiler)
         logger.info("Processes: {}".format(self._processes))
         logger.info("Chunksize: {}".format(self._chunksize))
+        logger.info("IRI cache size: {}".format(self._iri_cache_size))
+        logger.info("Chunks in flight: {}".format(self._in_flight))
 
-        self.np = Nanopublication(file_name)
-        # self.metadata = json.load(open(schema_file_name, 'r'))
-        self.metadata_graph = Graph()
-        with open(schema_file_name, 'rb') as f:
-            try:
-                self.metadata_graph.load(f, format='json-ld')
-            except ValueError as err:
-                err.message = err.message + " ; please check the syntax of your JSON-LD schema file"
-                raise
+        # Hash the source file in the background while the schema is being loaded
+        source_hash = SourceHash(file_name, background=True)
+
+        # A schema file is only parsed (and compiled) once by a process that converts it again, see load_schema()
+        self.schema_hash = git_hash_file(schema_file_name)
+        self.metadata_graph, cached_schema = load_schema(schema_file_name, self.schema_hash)
+
+        self.source_hash = source_hash.hexdigest()
+
+        self._checkpoint = None
+        if resume:
+            self._checkpoint = Checkpoint.load(self.checkpoint_file)
+            if self._checkpoint is None:
+                logger.warning("No checkpoint found for {}, converting from the start".format(self.target_file))
+
+        if self._checkpoint is None:
+            self.np = Nanopublication(file_name, source_hash=self.source_hash)
+        else:
+            # Recreate the nanopublication of the interrupted conversion, as its graph names are in the target file
+            self.np = Nanopublication(file_name, source_hash=self.source_hash,
+                                      timestamp=self._checkpoint.header['timestamp'],
+                                      default_graph=self._checkpoint.header['default_graph'])
 
         # from pprint import pprint
         # pprint([term for term in sorted(self.metadata_graph)])
@@ -266,41 +919,20 @@ class CSVWConverter(object):
         logger.warning(
             "Taking encoding, quotechar and delimiter specifications into account...")
 
-        # The metadata schema overrides the default namespace values
-        # (NB: this does not affect the predefined Namespace objects!)
-        # DEPRECATED
-        # namespaces.update({ns: url for ns, url in self.metadata['@context'][1].items() if not ns.startswith('@')})
-
-        # Cast the CSVW column rdf:List into an RDF collection
-        #print(self.schema.csvw_column)
-        # print(len(self.metadata_graph))
-
-        self.columns = Collection(self.metadata_graph, BNode(self.schema.csvw_column))
-        # Python 3 can't work out Item so we'll just SPARQL the graph
-
-        if not self.columns:
-            self.columns = [o for s,p,o in self.metadata_graph.triples((None, URIRef("http://www.w3.org/1999/02/22-rdf-syntax-ns#first"), None))]
-        #
-        # from pprint import pprint
-        # pprint(self.columns)
-        # print("LOOOOOOOOOOOOOOOOOOOOOOO")
-        # from pprint import pprint
-        # # pprint(self.schema.csvw_column)
-        # pprint([term for term in self.schema])
-        # pprint('----------')
-        # pprint([term for term in self.schema.csvw_column])
-
-        #print(self.schema.csvw_column)
+        # Compile the tableSchema into a plan that can be shipped to the BurstConverter
+        if cached_schema['plan'] is None:
+            cached_schema['plan'] = compile_schema(self.metadata_graph, self.schema.identifier)
+        self.plan = cached_schema['plan']
+        logger.info("Columns  : {}".format(len(self.plan.columns)))
 
 
     def convert_info(self):
         """Converts the CSVW JSON file to valid RDF for serializing into the Nanopublication publication info graph."""
 
-        results = self.metadata_graph.query("""SELECT ?s ?p ?o
-                                               WHERE { ?s ?p ?o .
-                                                       FILTER(?p = csvw:valueUrl ||
-                                                              ?p = csvw:propertyUrl ||
-                                                              ?p = csvw:aboutUrl)}""")
+        # A triple pattern per property rather than a SPARQL query, as the SPARQL parser of rdflib cannot be used
+        # by the conversions of several files (see ConversionPool) in threads at the same time
+        results = [(s, p, o) for p in (CSVW['valueUrl'], CSVW['propertyUrl'], CSVW['aboutUrl'])
+                   for s, o in self.metadata_graph.subject_objects(p)]
 
         for (s, p, o) in results:
             # Use iribaker
@@ -345,8 +977,57 @@ class CSVWConverter(object):
 
         return
 
+    def manifest(self):
+        """Returns the hashes of the source file and schema, and the options that determine the output of the conversion,
+        down to the order of the triples"""
+        return {
+            'source_hash': self.source_hash,
+            'schema_hash': self.schema_hash,
+            'options': {
+                'delimiter': self.delimiter,
+                'quotechar': self.quotechar,
+                'encoding': self.encoding,
+                'output_format': self.output_format,
+                'completion_order': self._completion_order,
+                'chunksize': self._chunksize,
+                'processes': self._processes,
+                'engine': self._engine
+            }
+        }
+
+    def checkpoint_header(self):
+        """Returns what a conversion can only be resumed with: the same manifest, which includes the number of
+        processes, as the schema derived triples that the workers send back depend on the chunks each converted"""
+        return {'manifest': self.manifest()}
+
+    def is_unchanged(self):
+        """Determines whether the target file was converted from the same source file and schema, with the same options"""
+        if not os.path.exists(self.target_file) or not os.path.exists(self.manifest_file):
+            return False
+        try:
+            with open(self.manifest_file, 'r') as f:
+                return json.load(f) == self.manifest()
+        except ValueError:
+            logger.warning("Could not read the manifest {}".format(self.manifest_file))
+            return False
+
     def convert(self):
-        """Starts a conversion process (in parallel or as a single process) as defined in the arguments passed to the :class:`CSVWConverter` initialization"""
+        """Starts a conversion process (in parallel or as a single process) as defined in the arguments passed to the :class:`CSVWConverter` initialization.
+        Skips the conversion if neither the source file, the schema nor the options changed since the previous one (unless ``force`` was set).
+        Returns whether the file was converted."""
+        # The triples are uploaded while they are converted, so an upload always converts the file
+        if not self._force and self._upload is None and self.is_unchanged():
+            logger.info("{} is up to date, skipping conversion (use force to convert anyway)".format(self.target_file))
+            return False
+
+        if self._checkpoint is not None and self._checkpoint.header['conversion'] != self.checkpoint_header():
+            raise Exception("Cannot resume the conversion of {}, as the source file, schema or options changed. "
+                            "Convert it without resuming instead.".format(self.file_name))
+
+        # The manifest is only written once the conversion has finished
+        if os.path.exists(self.manifest_file):
+            os.remove(self.manifest_file)
+
         logger.info("Starting conversion")
 
         # If the number of processes is set to 1, we start the 'simple' conversion (in a single thread)
@@ -358,86 +1039,759 @@ class CSVWConverter(object):
         elif self._processes > 1:
             try:
                 self._parallel()
-            except TypeError:
-                logger.info(
-                    "TypeError in multiprocessing... falling back to serial conversion")
-                self._simple()
-            except Exception:
-                logger.error(
-                    "Some exception occurred, falling back to serial conversion")
-                traceback.print_exc()
+            except Exception as e:
+                if self._upload is not None:
+                    # Converting the file again would upload the triples that were uploaded before again
+                    raise
+                if self._checkpoint is not None:
+                    # Converting the file from the start would truncate the target file and remove the
+                    # checkpoint, and with it the chunks that were converted before
+                    logger.error("The resumed conversion of {} failed, the checkpoint {} is kept to resume it "
+                                 "again".format(self.file_name, self.checkpoint_file))
+                    raise
+                if isinstance(e, TypeError):
+                    logger.info(
+                        "TypeError in multiprocessing... falling back to serial conversion")
+                else:
+                    logger.error(
+                        "Some exception occurred, falling back to serial conversion")
+                    traceback.print_exc()
                 self._simple()
         else:
             logger.error("Incorrect process count specification")
+            return False
+
+        with open(self.manifest_file, 'w') as f:
+            json.dump(self.manifest(), f, indent=True, sort_keys=True)
+
+        if self._profile is not None:
+            self.write_profile()
+        return True
+
+    def write_profile(self):
+        """Writes the timings and counters of the conversion stages (and the cProfile or tracemalloc results, if
+        these were collected) to a JSON report next to the target file. The merged cProfile statistics are written
+        to a .prof file that can be loaded with ``pstats``."""
+        report = self._profile.report(self.target_file + '.prof')
+        report.update(file=self.file_name, output=self.target_file, processes=self._processes,
+                      chunksize=self._chunksize, output_format=self.output_format)
+        with open(self.profile_file, 'w') as f:
+            json.dump(report, f, indent=True, sort_keys=True)
+        logger.info("Wrote profile of the conversion to {}".format(self.profile_file))
 
     def _simple(self):
         """Starts a single process for converting the file"""
-        with open(self.target_file, 'wb') as target_file:
-            with open(self.file_name, 'rb') as csvfile:
-                logger.info("Opening CSV file for reading")
-                reader = csv.DictReader(csvfile,
-                                        encoding=self.encoding,
-                                        delimiter=self.delimiter,
-                                        quotechar=self.quotechar)
-
-                logger.info("Starting in a single process")
-                c = BurstConverter(self.np.ag.identifier, self.columns,
-                                   self.schema, self.metadata_graph, self.encoding, self.output_format)
-                # Out will contain an N-Quads serialized representation of the
-                # converted CSV
-                out = c.process(0, reader, 1)
-                # We then write it to the file
-                try:
-                    # Python 2
-                    target_file.write(out)
-                except TypeError:
-                    # Python 3
-                    target_file.write(out.decode('utf-8'))
+        if self._checkpoint is not None:
+            logger.warning("Only parallel conversions can be resumed, converting from the start")
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
 
-            self.convert_info()
-            # Finally, write the nanopublication info to file
-            target_file.write(self.np.serialize(format=self.output_format))
+        with open(self.target_file, 'wb') as target_file:
+            target_file.write(self._compressed(self._file_header()))
+            with self.write_chunks(target_file) as writer:
+                with open_compressed(self.file_name) as csvfile:
+                    logger.info("Opening CSV file for reading")
+                    reader = csv.DictReader(csvfile,
+                                            encoding=self.encoding,
+                                            delimiter=self.delimiter,
+                                            quotechar=self.quotechar)
+
+                    logger.info("Starting in a single process")
+                    if self.output_format in STREAMING_FORMATS:
+                        # The file is converted (and written) a chunk at a time, like in a parallel conversion
+                        chunks = grouper(self._chunksize, reader)
+                    else:
+                        # Serializations of rdflib graphs cannot be concatenated
+                        chunks = [list(reader)]
+
+                    # This process converts the chunks itself, as the only worker
+                    _initWorker(*self._worker_args(), key=self._key)
+                    iri_cache_stats = {'hits': 0, 'misses': 0}
+                    self._suppressed = 0
+                    self._schema_triples = TripleFilter(self.np.ag.identifier)
+                    for count, rows in enumerate(chunks):
+                        result = _burstConvert(self._key, None, (count, rows))
+                        if result is None:
+                            raise Exception("Could not convert chunk {} of {}".format(count, self.file_name))
+                        _, out, schema_triples, stats = result
+                        with self._stage('write'):
+                            writer.write(self._merged(out))
+                            self._write_schema_triples(writer, schema_triples)
+                        self._add_chunk_stats(stats, iri_cache_stats)
+                    log_iri_cache_stats(iri_cache_stats)
+                    log_suppressed(self._suppressed + self._schema_triples.suppressed)
+
+                with self._stage('nanopublication'):
+                    self.convert_info()
+                    # Finally, write the nanopublication info to file
+                    writer.write(self._compressed(self.serialize_nanopublication()), tee=False)
+
+    @contextmanager
+    def write_chunks(self, target_file):
+        """Returns a context manager with an :class:`AsyncWriter` that writes to the ``target_file``, and that is
+        closed (after writing everything that is queued) at the end of the block. When uploading, the writer
+        passes the chunks on to a :class:`GraphStoreUploader` for the assertion graph."""
+        uploader = None
+        if self._upload is not None:
+            if self._checkpoint is not None:
+                logger.warning("Resuming the conversion, only the chunks after the checkpoint are uploaded")
+            suffix = None
+            if self.output_format == 'nquads':
+                suffix = StreamingGraph(self.np.ag.identifier, self.output_format).line_suffix
+            uploader = GraphStoreUploader(graph=text_type(self.np.ag.identifier), line_suffix=suffix,
+                                          compressed=self._compress, **self._upload)
+
+        writer = AsyncWriter(target_file, self._write_queue, self._fsync, uploader.add if uploader else None)
+        try:
+            yield writer
+        finally:
+            try:
+                writer.close()
+            finally:
+                if uploader is not None:
+                    with self._stage('upload'):
+                        uploader.close()
+        writer.log_stats()
+        if uploader is not None:
+            uploader.log_stats()
+        if self._profile is not None:
+            self._profile.writer = writer.stats()
+            if uploader is not None:
+                self._profile.upload = uploader.stats()
+
+    def _file_header(self):
+        """Returns the start of the target file: the magic bytes of a binary file, or the prefixes of Turtle and TriG"""
+        if self._merger is not None:
+            return BINARY_MAGIC
+        return prefix_header(self.output_format)
+
+    def _merged(self, data):
+        """Returns the converted chunk ``data`` of a worker to write to the target file. For binary output, the terms
+        of the chunk are merged into the dictionary of the file (and the blocks compressed, see _worker_args)."""
+        if self._merger is not None:
+            return self._compressed(self._merger.merge(data))
+        return data
+
+    def serialize_nanopublication(self):
+        """Returns the nanopublication graphs in the output format"""
+        if self._merger is not None:
+            default = self.np.default_context.identifier
+            return self._merger.encode((s, p, o, default if g is None else getattr(g, 'identifier', g))
+                                       for s, p, o, g in self.np.quads((None, None, None, None)))
+        return self.np.serialize(format=self.output_format)
+
+    def _compressed(self, data):
+        """Returns the ``data`` to write to the target file, as a gzip member if the output is compressed"""
+        if self._compress:
+            return gzip_member(data)
+        return data
+
+    def _stage(self, stage):
+        """Returns a context manager that times a ``stage`` of the conversion in this process, if profiling"""
+        if self._profile is None:
+            return _no_stage()
+        return self._profile.parent.time(stage)
 
     def _parallel(self):
         """Starts parallel processes for converting the file. Each process will receive max ``chunksize`` number of rows"""
-        with open(self.target_file, 'wb') as target_file:
-            with open(self.file_name, 'rb') as csvfile:
-                logger.info("Opening CSV file for reading")
-                reader = csv.DictReader(csvfile,
-                                        encoding=self.encoding,
-                                        delimiter=self.delimiter,
-                                        quotechar=self.quotechar)
-
-                # Initialize a pool of processes (default=4)
-                pool = mp.Pool(processes=self._processes)
-                logger.info("Running in {} processes".format(self._processes))
-
-                # The _burstConvert function is partially instantiated, and will be successively called with
-                # chunksize rows from the CSV file
-                # print("LOOOOOOOOOOOOOOOOOOOOOOO")
-                # from pprint import pprint
-                # pprint([term.n3() for term in self.columns])
-                burstConvert_partial = partial(_burstConvert,
-                                               identifier=self.np.ag.identifier,
-                                               columns=self.columns,
-                                               schema=self.schema,
-                                               metadata_graph=self.metadata_graph,
-                                               encoding=self.encoding,
-                                               chunksize=self._chunksize,
-                                               output_format=self.output_format)
-
+        if self._sharded and not shardable(self.encoding):
+            logger.warning("Cannot shard a CSV file with encoding {}, reading it in a single process".format(self.encoding))
+            self._sharded = False
+        if self._sharded and compression(self.file_name) is not None:
+            logger.warning("Cannot shard a compressed CSV file, reading it in a single process")
+            self._sharded = False
+
+        if self._checkpoint is not None:
+            # Continue after the last chunk that was completely written to the target file
+            checkpoint = self._checkpoint
+            target_file = open(self.target_file, 'r+b')
+            checkpoint.truncate(target_file)
+            if self._merger is not None:
+                # The chunks after the checkpoint continue the term dictionary of the file
+                target_file.flush()
+                self._merger.load(self.target_file)
+            logger.info("Resuming conversion, skipping {} converted chunks".format(len(checkpoint.chunks)))
+        else:
+            target_file = open(self.target_file, 'wb')
+            target_file.write(self._compressed(self._file_header()))
+            header = {'conversion': self.checkpoint_header(),
+                      'timestamp': self.np.timestamp,
+                      'default_graph': text_type(self.np.default_context.identifier),
+                      'offset': target_file.tell()}
+            checkpoint = Checkpoint.create(self.checkpoint_file, header)
+
+        with target_file, self.write_chunks(target_file) as writer:
+            if self._sharded:
+                with CSVShards(self.file_name, self._chunksize, self.encoding, self.delimiter, self.quotechar) as shards:
+                    logger.info("Sharding CSV file for reading by the worker processes")
+                    # The workers parse the byte ranges themselves, using the header read by the shards
+                    source = {'file_name': self.file_name,
+                              'fieldnames': shards.fieldnames,
+                              'delimiter': self.delimiter,
+                              'quotechar': self.quotechar}
+                    self._run_pool(writer, shards, checkpoint, source)
+            else:
+                with open_compressed(self.file_name) as csvfile:
+                    logger.info("Opening CSV file for reading")
+                    reader = csv.DictReader(csvfile,
+                                            encoding=self.encoding,
+                                            delimiter=self.delimiter,
+                                            quotechar=self.quotechar)
+
+                    self._run_pool(writer, grouper(self._chunksize, reader), checkpoint)
+
+            with self._stage('nanopublication'):
+                self.convert_info()
+                # Finally, write the nanopublication info to file
+                writer.write(self._compressed(self.serialize_nanopublication()), tee=False)
+
+        checkpoint.remove()
+
+    def _worker_args(self, source=None, spill_dir=None):
+        """Returns the arguments of :func:`_initWorker` for the workers of this conversion"""
+        profile = None
+        if self._profile is not None:
+            profile = {'profiler': self._profile.profiler, 'directory': self._profile.directory}
+        # The blocks of binary output are only compressed once they are merged
+        compress = self._compress and self._merger is None
+        return (self.np.ag.identifier, self.plan, self.encoding, self._chunksize, self.output_format,
+                self._iri_cache_size, source, spill_dir, profile, compress, self._engine)
+
+    def _run_pool(self, writer, chunks, checkpoint, source=None):
+        """Converts the ``chunks`` (lists of rows, or byte ranges of the ``source`` file) in a pool of processes,
+        and writes the results with the :class:`AsyncWriter` ``writer``. Chunks that are in the ``checkpoint``
+        are skipped, and the others are added to it once they are written."""
+        spill_dir = None
+        if self._unordered:
+            # Workers write their results to numbered spill files next to the target file
+            spill_dir = tempfile.mkdtemp(prefix='.cow-spill-', dir=os.path.dirname(os.path.abspath(self.target_file)))
+
+        settings = None
+
+        if self._pool is None:
+            # Initialize a pool of processes (default=4). The conversion plan and settings are sent to
+            # each worker only once, so that the tasks only carry the chunksize rows from the CSV file
+            with self._stage('pool'):
+                pool = mp.Pool(processes=self._processes,
+                               initializer=_initWorker,
+                               initargs=self._worker_args(source, spill_dir) + (self._key,))
+            logger.info("Running in {} processes".format(self._processes))
+        else:
+            # The workers of a shared pool are not initialized for this conversion, so the chunks carry the name of a
+            # file with the pickled settings, that each worker only loads for the first chunk it converts
+            pool = self._pool.pool
+            handle, settings = tempfile.mkstemp(prefix='.cow-settings-', suffix='.pickle',
+                                                dir=os.path.dirname(os.path.abspath(self.target_file)))
+            with os.fdopen(handle, 'wb') as f:
+                pickle.dump(self._worker_args(source, spill_dir), f, pickle.HIGHEST_PROTOCOL)
+            logger.info("Running in a pool of {} processes shared with other conversions".format(self._pool.processes))
+
+        done = set(checkpoint.chunks)
+        # Chunks keep their number (and thereby their row numbers) when earlier chunks are skipped
+        tasks = ((count, chunk) for count, chunk in enumerate(chunks) if count not in done)
+        if self._profile is not None:
+            # The chunks are read by the thread of the pool that hands out the tasks
+            tasks = self._profile.parent.timed(tasks, 'read')
+        # The thread of the pool that hands out the tasks blocks until a slot is released for a converted chunk
+        tasks = BoundedTasks(tasks, self._in_flight)
+
+        iri_cache_stats = {'hits': 0, 'misses': 0}
+        self._suppressed = 0
+        self._schema_triples = TripleFilter(self.np.ag.identifier)
+        try:
+            if spill_dir is None:
                 # The result of each chunksize run will be written to the
                 # target file
-                for out in pool.imap(burstConvert_partial, enumerate(grouper(self._chunksize, reader))):
-                    target_file.write(out)
+                results = self._map(pool, partial(_burstConvert, self._key, settings), tasks)
+                if self._profile is not None:
+                    results = self._profile.parent.timed(results, 'wait')
+                for result in results:
+                    count, out, schema_triples, stats = self._chunk_result(result)
+                    with self._stage('write'):
+                        writer.write(self._merged(out))
+                        self._write_schema_triples(writer, schema_triples)
+                        writer.call(partial(checkpoint.log, count))
+                    tasks.release()
+                    self._add_chunk_stats(stats, iri_cache_stats)
+            else:
+                logger.info("Spilling chunks to {}".format(spill_dir))
+                # Spill files of chunks that completed before the chunks preceding them
+                pending = {}
+                next_count = 0
+                results = self._map(pool, partial(_spillConvert, self._key, settings), tasks, ordered=False)
+                if self._profile is not None:
+                    results = self._profile.parent.timed(results, 'wait')
+                for result in results:
+                    count, spill_file, schema_triples, stats = self._chunk_result(result)
+                    # The converted chunk is on disk, so it no longer takes up memory
+                    tasks.release()
+                    self._add_chunk_stats(stats, iri_cache_stats)
+
+                    if self._completion_order:
+                        with self._stage('write'):
+                            writer.append_file(spill_file)
+                            self._write_schema_triples(writer, schema_triples)
+                            writer.call(partial(checkpoint.log, count))
+                        continue
 
-                # Make sure to close and join the pool once finished.
-                pool.close()
+                    pending[count] = (spill_file, schema_triples)
+                    while next_count in pending or next_count in done:
+                        if next_count in pending:
+                            spill_file, schema_triples = pending.pop(next_count)
+                            with self._stage('write'):
+                                writer.append_file(spill_file)
+                                self._write_schema_triples(writer, schema_triples)
+                                writer.call(partial(checkpoint.log, next_count))
+                        next_count += 1
+        except BaseException:
+            if self._pool is None:
+                # Stop the workers now, instead of leaving them to the garbage collector (once the thread of the
+                # pool that hands out the tasks no longer waits for a slot)
+                tasks.close()
+                pool.terminate()
                 pool.join()
+            raise
+        finally:
+            # Stop handing out tasks if the conversion failed
+            tasks.close()
+            if spill_dir is not None:
+                # The writer may not have appended all spill files yet
+                writer.wait()
+                shutil.rmtree(spill_dir, ignore_errors=True)
+            if settings is not None:
+                os.remove(settings)
+
+        log_iri_cache_stats(iri_cache_stats)
+        log_suppressed(self._suppressed + self._schema_triples.suppressed)
+        logger.debug("Waited {:.3f} seconds for the workers to take up chunks".format(tasks.waited))
+        if self._profile is not None:
+            self._profile.parent.add('backpressure', tasks.waited, tasks.waits)
+
+        if self._pool is None:
+            # Make sure to close and join the pool once finished.
+            pool.close()
+            pool.join()
+
+    def _write_schema_triples(self, writer, triples):
+        """Writes the schema derived ``triples`` of a converted chunk, that were not written for an earlier chunk. The
+        workers leave these out of their chunks, as they only know the triples of the chunks they converted themselves."""
+        triples = [triple for triple in triples if self._schema_triples.add(triple)]
+        if not triples:
+            return
+        if self._merger is not None:
+            identifier = self.np.ag.identifier
+            data = self._merger.encode([(s, p, o, identifier) for s, p, o in triples])
+        else:
+            g = StreamingGraph(self.np.ag.identifier, self.output_format)
+            for triple in triples:
+                g.add(triple)
+            data = g.serialize()
+        writer.write(self._compressed(data))
+
+    def _chunk_result(self, result):
+        """Returns the ``result`` of a worker, or raises an exception if the worker could not convert its chunk"""
+        if result is None:
+            # The worker logged the error
+            raise Exception("A worker process could not convert a chunk of {}".format(self.file_name))
+        return result
+
+    def _map(self, pool, function, tasks, ordered=True):
+        """Returns the results of the ``function`` for the ``tasks`` in the ``pool``, in the order of the tasks or
+        (if not ``ordered``) in the order they complete. The tasks for a shared pool are handed to it by a
+        :class:`SubmittedTasks` thread of this conversion, as the single thread of the pool that hands out the tasks
+        of ``imap`` would only start on the tasks of the next conversion once the current one has been read."""
+        if self._pool is not None:
+            return SubmittedTasks(pool, function, tasks, ordered)
+        if ordered:
+            return pool.imap(function, tasks)
+        return pool.imap_unordered(function, tasks)
+
+    def _add_chunk_stats(self, stats, iri_cache_stats):
+        """Adds the IRI cache statistics, suppressed triples (and profile, if any) of a converted chunk to the totals"""
+        for k in iri_cache_stats:
+            iri_cache_stats[k] += stats[k]
+        self._suppressed += stats['suppressed']
+        if self._profile is not None:
+            self._profile.add_chunk(stats['profile'])
+
+
+class Checkpoint(object):
+    """A log of the chunks of a parallel conversion that have been written to the target file, and the
+    offset in the target file after each of them. The first line is a header that describes the conversion
+    (see :meth:`CSVWConverter.checkpoint_header`) and the offset of the first chunk; all lines are JSON."""
+
+    def __init__(self, file_name, header, chunks, size):
+        self.file_name = file_name
+        self.header = header
+        # Chunk numbers and the target file offset after each chunk, in the order they were written
+        self.chunks = OrderedDict(chunks)
+        self._file = open(file_name, 'r+b' if size else 'wb')
+        self._file.truncate(size)
+        self._file.seek(size)
+
+    @classmethod
+    def create(cls, file_name, header):
+        checkpoint = cls(file_name, header, [], 0)
+        checkpoint._write(header)
+        return checkpoint
+
+    @classmethod
+    def load(cls, file_name):
+        """Reads the checkpoint in ``file_name``, ignoring a trailing line that was not completely written.
+        Returns None if there is no (readable) checkpoint."""
+        if not os.path.exists(file_name):
+            return None
+
+        header = None
+        chunks = []
+        size = 0
+        with open(file_name, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                if header is None:
+                    header = entry
+                else:
+                    chunks.append((entry['chunk'], entry['offset']))
+                size += len(line)
+
+        if header is None:
+            return None
+        return cls(file_name, header, chunks, size)
+
+    def truncate(self, target_file):
+        """Truncates the ``target_file`` to the end of the last chunk in the checkpoint that it fully contains,
+        and forgets the chunks after it"""
+        target_file.seek(0, os.SEEK_END)
+        size = target_file.tell()
+
+        offset = self.header['offset']
+        consistent = 0
+        for count, end in self.chunks.items():
+            if end > size:
+                break
+            offset = end
+            consistent += 1
+
+        if consistent < len(self.chunks):
+            logger.warning("The target file ends before the last {} chunks in the checkpoint".format(len(self.chunks) - consistent))
+            self.chunks = OrderedDict(list(self.chunks.items())[:consistent])
+            self._file.seek(0)
+            self._file.truncate()
+            self._write(self.header)
+            for count, end in self.chunks.items():
+                self._write({'chunk': count, 'offset': end})
+
+        target_file.seek(offset)
+        target_file.truncate()
+
+    def log(self, count, offset):
+        """Records that chunk ``count`` has been written to the target file, which ends at ``offset`` after it"""
+        self.chunks[count] = offset
+        self._write({'chunk': count, 'offset': offset})
+
+    def remove(self):
+        self._file.close()
+        os.remove(self.file_name)
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, sort_keys=True).encode('utf-8') + b'\n')
+        self._file.flush()
+
+
+# The minimum size of the writes of an AsyncWriter (if that much is queued), and the number
+# of bytes after which it syncs the target file to disk (if enabled)
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+FSYNC_BATCH_SIZE = 64 * 1024 * 1024
+
+
+class AsyncWriter(object):
+    """
+    Writes converted chunks to the ``target_file`` in a separate thread, so that the conversion can read and hand
+    out the next chunks while the previous ones are written. The chunks are passed through a queue of at most
+    ``queue_size`` items (adding to a full queue blocks), and whatever is queued is written at once, in writes of at
+    least WRITE_BUFFER_SIZE bytes. With ``fsync``, the file is synced to disk after every FSYNC_BATCH_SIZE bytes.
+
+    Callbacks (see :meth:`call`) are called by the writer thread with the offset in the target file of the end of
+    everything queued before them, once that has been written (and synced to disk, with ``fsync``), e.g. to log a
+    chunk in the :class:`Checkpoint`.
+
+    The depth of the queue is sampled whenever something is added to it: a queue that is usually full (and time
+    spent waiting for room in it) means that the conversion is I/O bound.
+
+    If a ``tee`` is given, the writer thread also calls it with the data of every chunk (and spill file).
+    """
+
+    def __init__(self, target_file, queue_size=16, fsync=False, tee=None):
+        self.target_file = target_file
+        self.tee = tee
+        self.queue_size = max(1, queue_size)
+        self.fsync = fsync
+        self.error = None
+
+        self.items = 0
+        self.bytes = 0
+        self.writes = 0
+        self.fsyncs = 0
+        self.max_depth = 0
+        self._depths = 0
+        # The time spent waiting for room in the queue, and the time spent by the writer writing and syncing
+        self.blocked = 0.0
+        self.busy = 0.0
+
+        self._queue = Queue(maxsize=self.queue_size)
+        self._buffer = []
+        self._buffered = 0
+        self._callbacks = []
+        self._unsynced = 0
+        # The offset in the target file of the end of everything taken from the queue
+        self._offset = target_file.tell()
+        self._thread = threading.Thread(target=self._run, name='cow-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, data, tee=True):
+        """Queues the bytes ``data`` to be written (and passed to the tee, unless ``tee`` is False)"""
+        if data:
+            self._put(('data' if tee else 'untee', data))
+
+    def append_file(self, file_name):
+        """Queues the contents of the (spill) file ``file_name`` to be written, the file is removed afterwards"""
+        self._put(('file', file_name))
+
+    def call(self, callback):
+        """Queues the ``callback`` to be called with the offset of the end of everything queued before it,
+        once that is written"""
+        self._put(('call', callback))
+
+    def wait(self):
+        """Waits until everything that is queued has been taken from the queue (spill files have been written)"""
+        self._queue.join()
+
+    def close(self):
+        """Writes everything that is queued, and stops the writer thread. Raises the error of the writer, if any."""
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _put(self, item):
+        if self.error is not None:
+            raise self.error
+
+        depth = self._queue.qsize()
+        self.items += 1
+        self._depths += depth
+        self.max_depth = max(self.max_depth, depth)
+
+        start = timeit.default_timer()
+        self._queue.put(item)
+        self.blocked += timeit.default_timer() - start
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            # After an error, keep emptying the queue, so that nothing blocks on it
+            if self.error is None:
+                try:
+                    if item is None:
+                        self._flush(final=True)
+                    else:
+                        self._handle(item)
+                except Exception as e:
+                    traceback.print_exc()
+                    self.error = e
+            self._queue.task_done()
+            if item is None:
+                return
+
+    def _handle(self, item):
+        kind, value = item
+        if kind == 'file' and self.tee is not None:
+            # The tee needs the contents of the spill file anyway, so it is written like a chunk
+            with open(value, 'rb') as f:
+                data = f.read()
+            os.remove(value)
+            kind, value = 'data', data
+
+        if kind in ('data', 'untee'):
+            if kind == 'data' and self.tee is not None:
+                self.tee(value)
+            self._buffer.append(value)
+            self._buffered += len(value)
+            self._offset += len(value)
+        elif kind == 'file':
+            self._flush()
+            start = timeit.default_timer()
+            size = os.path.getsize(value)
+            _append_spill_file(self.target_file, value)
+            self.bytes += size
+            self._unsynced += size
+            self._offset += size
+            self.busy += timeit.default_timer() - start
+        else:
+            self._callbacks.append((value, self._offset))
+
+        if self._buffered >= WRITE_BUFFER_SIZE or self._queue.empty():
+            self._flush()
+
+    def _flush(self, final=False):
+        """Writes the buffered data, syncs it to disk if needed, and calls the callbacks for what has been written"""
+        start = timeit.default_timer()
+        if self._buffer:
+            data = b''.join(self._buffer)
+            self.target_file.write(data)
+            self.writes += 1
+            self.bytes += len(data)
+            self._unsynced += len(data)
+            self._buffer = []
+            self._buffered = 0
+
+        if self.fsync and self._unsynced and (self._unsynced >= FSYNC_BATCH_SIZE or final):
+            self.target_file.flush()
+            os.fsync(self.target_file.fileno())
+            self.fsyncs += 1
+            self._unsynced = 0
+
+        if self._callbacks and (not self.fsync or not self._unsynced):
+            self.target_file.flush()
+            callbacks, self._callbacks = self._callbacks, []
+            for callback, offset in callbacks:
+                callback(offset)
+        self.busy += timeit.default_timer() - start
+
+    def stats(self):
+        """Returns the metrics of the writer: the amount written, and the depth of the queue when adding to it"""
+        return {
+            'items': self.items,
+            'bytes': self.bytes,
+            'writes': self.writes,
+            'fsyncs': self.fsyncs,
+            'queue_size': self.queue_size,
+            'max_queue_depth': self.max_depth,
+            'mean_queue_depth': round(float(self._depths) / self.items, 2) if self.items else 0.0,
+            'blocked_seconds': round(self.blocked, 6),
+            'busy_seconds': round(self.busy, 6)
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info("Wrote {bytes} bytes in {writes} writes ({fsyncs} fsyncs), write queue depth {mean_queue_depth} "
+                    "on average and {max_queue_depth} at most (of {queue_size})".format(**stats))
+        logger.info("Waited {blocked_seconds:.3f} s for the writer, which spent {busy_seconds:.3f} s writing".format(**stats))
+
+
+def _append_spill_file(target_file, spill_file):
+    """Copies the contents of the ``spill_file`` to the ``target_file``, and removes it"""
+    with open(spill_file, 'rb') as f:
+        shutil.copyfileobj(f, target_file, 1024 * 1024)
+    os.remove(spill_file)
+
+
+def shardable(encoding):
+    """Determines whether the record boundaries of a CSV file in ``encoding`` can be found without decoding it,
+    i.e. whether all bytes below 0x80 are ASCII characters (and never part of a multibyte character)"""
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        return False
+    return name in ('ascii', 'utf-8', 'utf-8-sig') or name.startswith(('iso8859', 'cp125', 'mac-'))
+
+
+class CSVShards(object):
+    """Splits a CSV file into byte ranges of at most ``chunksize`` records, without decoding or parsing it,
+    so that the worker processes can read and parse their own part of the file.
+
+    Iterating over the shards yields ``(offset, length, first_row)`` tuples, where ``first_row`` is the
+    ``_row`` number of the first record in the range. Newlines inside quoted fields do not end a record,
+    and blank lines are not counted as records (as the csv reader skips them)."""
+
+    def __init__(self, file_name, chunksize, encoding='utf-8', delimiter=',', quotechar='\"'):
+        self.file_name = file_name
+        self.chunksize = chunksize
+        self.encoding = encoding
+        self.delimiter = delimiter.encode(encoding)
+        self.quotechar = quotechar.encode(encoding) if quotechar else None
+        self.fieldnames = None
+
+    def __enter__(self):
+        self._file = open(self.file_name, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        # An empty file cannot be mapped
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+        # The first record is the header
+        self._start = 0
+        for start, end in self._records(0):
+            header = self._data[start:end]
+            self.fieldnames = next(csv.reader(io.BytesIO(header), encoding=self.encoding,
+                                              delimiter=self.delimiter.decode(self.encoding),
+                                              quotechar=self.quotechar.decode(self.encoding) if self.quotechar else None))
+            self._start = end
+            break
+
+        return self
+
+    def __exit__(self, *args):
+        if self._data:
+            self._data.close()
+        self._file.close()
+
+    def __iter__(self):
+        first_row = 0
+        offset = None
+        count = 0
+        for start, end in self._records(self._start):
+            if offset is None:
+                offset = start
+            count += 1
+            if count == self.chunksize:
+                yield (offset, end - offset, first_row)
+                first_row += count
+                offset = None
+                count = 0
+
+        if count:
+            yield (offset, end - offset, first_row)
+
+    def _records(self, pos):
+        """Generates the (start, end) byte offsets of the records from ``pos`` onwards"""
+        data = self._data
+        size = len(data)
+        q = self.quotechar
+        d = self.delimiter
+
+        while pos < size:
+            start = pos
+            in_quotes = False
+            while True:
+                nl = data.find(b'\n', pos)
+                line_end = size if nl == -1 else nl
+                # Find the quotes on this line that open or close a quoted field
+                i = data.find(q, pos, line_end) if q else -1
+                while i != -1:
+                    if in_quotes:
+                        if data[i + 1:i + 2] == q:
+                            # An escaped (double) quote
+                            i = data.find(q, i + 2, line_end)
+                            continue
+                        in_quotes = False
+                    elif i == start or data[i - 1:i] == d:
+                        # Quotes only start a quoted field at the start of a field
+                        in_quotes = True
+                    i = data.find(q, i + 1, line_end)
+
+                pos = size if nl == -1 else nl + 1
+                if not in_quotes or pos >= size:
+                    break
 
-            self.convert_info()
-            # Finally, write the nanopublication info to file
-            target_file.write(self.np.serialize(format=self.output_format))
+            # Skip blank lines
+            if pos - start > 2 or data[start:pos].strip(b'\r\n'):
+                yield start, pos
 
 
 def grouper(n, iterable, padvalue=None):
@@ -445,52 +1799,468 @@ def grouper(n, iterable, padvalue=None):
     return zip_longest(*[iter(iterable)] * n, fillvalue=padvalue)
 
 
-# This has to be a global method for the parallelization to work.
-def _burstConvert(enumerated_rows, identifier, columns, schema, metadata_graph, encoding, chunksize, output_format):
-    """The method used as partial for the parallel processing initiated in :func:`_parallel`."""
+class BoundedTasks(object):
+    """Hands out the ``tasks`` (chunks) to the pool, but blocks while ``limit`` of them are in flight: until
+    :meth:`release` is called for a converted chunk, or the tasks are closed. Without this, the thread of the pool
+    that hands out the tasks reads the entire CSV file into memory if the workers cannot keep up."""
+
+    def __init__(self, tasks, limit):
+        self._tasks = iter(tasks)
+        self.limit = max(1, limit)
+        self.in_flight = 0
+        # The time spent (and the number of times) waiting for a slot
+        self.waited = 0.0
+        self.waits = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def __iter__(self):
+        while True:
+            with self._condition:
+                if self.in_flight >= self.limit and not self._closed:
+                    start = timeit.default_timer()
+                    while self.in_flight >= self.limit and not self._closed:
+                        self._condition.wait()
+                    self.waited += timeit.default_timer() - start
+                    self.waits += 1
+                if self._closed:
+                    return
+                self.in_flight += 1
+
+            # The next chunk is only read once there is a slot for it
+            try:
+                task = next(self._tasks)
+            except StopIteration:
+                return
+            yield task
+
+    def release(self):
+        """Frees the slot of a chunk that is converted"""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def close(self):
+        """Stops handing out tasks"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class SubmittedTasks(object):
+    """Submits the ``tasks`` to a (shared) ``pool`` from a thread of its own, and iterates over the results of the
+    ``function`` for the tasks: in the order of the tasks, or (if not ``ordered``) in the order they complete.
+    Unlike ``imap``, this does not hold up the single thread of the pool that hands out tasks while the
+    :class:`BoundedTasks` block, so the tasks of the other conversions in the pool keep being handed out.
+    The ``function`` should return None instead of raising an exception; exceptions raised while reading or
+    submitting the tasks (or by a task, e.g. when its arguments cannot be pickled) are raised by the iterator."""
+
+    class _Done(object):
+        """Marks the end of the submitted tasks, and holds the exception that ended them early, if any"""
+
+        def __init__(self, submitted, error=None):
+            self.submitted = submitted
+            self.error = error
+
+    class _Failed(object):
+        """The exception of a task that did not complete"""
+
+        def __init__(self, error):
+            self.error = error
+
+    def __init__(self, pool, function, tasks, ordered=True):
+        self._ordered = ordered
+        self._results = Queue()
+        self._thread = threading.Thread(target=self._submit, args=(pool, function, tasks), name='cow-submit')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _submit(self, pool, function, tasks):
+        submitted = 0
+        error = None
+        try:
+            for task in tasks:
+                if self._ordered:
+                    self._results.put(pool.apply_async(function, (task,)))
+                else:
+                    self._apply_unordered(pool, function, task)
+                submitted += 1
+        except Exception as e:
+            logger.error("Could not submit the chunks to the pool: {}".format(e))
+            error = e
+        # The number of results to wait for
+        self._results.put(SubmittedTasks._Done(submitted, error))
+
+    def _apply_unordered(self, pool, function, task):
+        failed = lambda e: self._results.put(SubmittedTasks._Failed(e))
+        try:
+            # Python 3
+            pool.apply_async(function, (task,), callback=self._results.put, error_callback=failed)
+        except TypeError:
+            # Python 2, exceptions of the pool are not reported
+            pool.apply_async(function, (task,), callback=self._results.put)
+
+    def __iter__(self):
+        received = 0
+        submitted = None
+        error = None
+        # Wait for all submitted tasks, also when the submission failed, so that none of them is still running
+        while submitted is None or received < submitted:
+            item = self._results.get()
+            if isinstance(item, SubmittedTasks._Done):
+                submitted = item.submitted
+                error = item.error
+                continue
+            received += 1
+            if isinstance(item, SubmittedTasks._Failed):
+                raise item.error
+            yield item.get() if self._ordered else item
+        if error is not None:
+            raise error
+
+
+class ConversionPool(object):
+    """
+    A pool of ``processes`` worker processes that is shared by the conversions of many files (see the ``pool``
+    argument of :class:`CSVWConverter`), so that they do not each start (and wind down) a pool of their own, and
+    the chunks of small files fill up the workers while a large file is converted. The workers are not initialized
+    for a conversion, each chunk carries the settings file of its conversion (see :func:`_worker_conversion`).
+    """
+
+    def __init__(self, processes=4):
+        self.processes = processes
+        self.pool = mp.Pool(processes=processes)
+        logger.info("Started a pool of {} processes".format(processes))
+
+    def build_schemas(self, builds):
+        """Builds the schemas for the keyword arguments of :func:`build_schema` in ``builds``, each in a single
+        process of the pool, and yields the names of the schema files as they are built"""
+        return self.pool.imap_unordered(_buildSchema, [dict(kwargs, processes=1) for kwargs in builds])
+
+    def close(self):
+        """Waits for the workers to finish the chunks they were given, and stops them"""
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+# The settings of the conversions this worker process converts chunks for (see _initWorker), by conversion key.
+# The workers of a ConversionPool convert chunks of many files, so they only keep those of the most recent ones.
+_worker_conversions = OrderedDict()
+WORKER_CONVERSIONS = 64
+
+
+# These have to be global methods for the parallelization to work.
+def _initWorker(identifier, plan, encoding, chunksize, output_format, iri_cache_size, source=None, spill_dir=None, profile=None, compress=False, engine='row', key=None):
+    """Initializes a worker process of the pool started in :func:`_parallel` (or the process of a :func:`_simple`
+    conversion), by keeping the conversion plan and settings around for all the chunks the worker converts. The ``source`` (file name, fieldnames
+    and dialect) is only given when the workers read their own byte ranges of the CSV file, the ``spill_dir``
+    only when they write their results to spill files, and the ``profile`` settings only when profiling.
+    If ``compress`` is set, the workers compress their results (as separate gzip members). The ``engine`` is
+    either 'row' (:class:`BurstConverter`) or 'columnar' (:class:`ColumnarConverter`). The settings are kept
+    under the ``key`` of the conversion, and returned."""
+    state = dict(identifier=identifier, plan=plan, encoding=encoding, chunksize=chunksize,
+                 output_format=output_format, iri_cache_size=iri_cache_size, source=source,
+                 spill_dir=spill_dir, profiler=None, compress=compress, engine=engine)
+    if profile is not None:
+        state['profiler'] = ChunkProfiler(profile['profiler'], profile['directory'])
+    _worker_conversions.pop(key, None)
+    _recent(_worker_conversions, key, lambda: state)
+    get_iri_cache(iri_cache_size)
+    # Nothing was written for the assertion graph yet, so start a new triple filter and term dictionary
+    _schema_triple_filters.pop((key, identifier), None)
+    _term_dictionaries.pop((key, identifier), None)
+    return state
+
+
+def _worker_conversion(key, settings):
+    """Returns the settings of conversion ``key`` in this worker. The workers of a shared :class:`ConversionPool`
+    get the name of the ``settings`` file (with the pickled arguments of :func:`_initWorker`) with every chunk, and
+    only load it to initialize a conversion the first time."""
+    state = _worker_conversions.pop(key, None)
+    if state is None:
+        if settings is None:
+            raise Exception("Conversion {} was not initialized in process {}".format(key, mp.current_process().name))
+        with open(settings, 'rb') as f:
+            return _initWorker(*pickle.load(f), key=key)
+    _worker_conversions[key] = state
+    return state
+
+
+def _burstConvert(key, settings, enumerated_rows):
+    """The method called for each chunk by the parallel processing initiated in :func:`_parallel`, for the
+    conversion ``key`` (see :func:`_worker_conversion`).
+    The chunk is either a list of rows, or an (offset, length, first_row) byte range of the source file.
+    Returns the chunk number, the serialized chunk, its schema derived triples (see :meth:`BurstConverter.add_schema_triple`)
+    and the IRI cache statistics (and profile) for the chunk."""
     try:
         count, rows = enumerated_rows
-        c = BurstConverter(identifier, columns, schema,
-                           metadata_graph, encoding, output_format)
+        state = _worker_conversion(key, settings)
+        profiler = state['profiler']
+        if state['engine'] == 'columnar':
+            converter_class = ColumnarConverter if profiler is None else TimedColumnarConverter
+        else:
+            converter_class = BurstConverter if profiler is None else TimedBurstConverter
+        c = converter_class(state['identifier'], state['plan'], state['encoding'], state['output_format'],
+                            state['iri_cache_size'], conversion=key)
+
+        with profiler or _no_stage():
+            source = state['source']
+            if source is None:
+                logger.info("Process {}, nr {}, {} rows".format(
+                    mp.current_process().name, count, len(rows)))
+
+                result = c.process(count, rows, state['chunksize'])
+            else:
+                offset, length, first_row = rows
+                logger.info("Process {}, nr {}, {} bytes".format(
+                    mp.current_process().name, count, length))
+
+                with open(source['file_name'], 'rb') as csvfile:
+                    csvfile.seek(offset)
+                    reader = csv.DictReader(io.BytesIO(csvfile.read(length)),
+                                            fieldnames=source['fieldnames'],
+                                            encoding=state['encoding'],
+                                            delimiter=source['delimiter'],
+                                            quotechar=source['quotechar'])
+                    # Row numbers continue from the first record in the byte range
+                    result = c.process(first_row, reader, 1)
+
+        if state['compress']:
+            result = gzip_member(result)
 
-        logger.info("Process {}, nr {}, {} rows".format(
-            mp.current_process().name, count, len(rows)))
+        logger.info("Process {} done".format(mp.current_process().name))
+
+        stats = dict(c.iri_cache_stats, suppressed=c.suppressed)
+        if profiler is not None:
+            stats['profile'] = c.profile_stats(profiler)
+        return count, result, c.new_schema_triples, stats
+    except:
+        traceback.print_exc()
 
-        result = c.process(count, rows, chunksize)
 
-        logger.info("Process {} done".format(mp.current_process().name))
+def _spillConvert(key, settings, enumerated_rows):
+    """Converts a chunk like :func:`_burstConvert`, but writes the result to a numbered spill file.
+    Returns the chunk number, the name of the spill file, the schema derived triples and the IRI cache statistics for the chunk."""
+    result = _burstConvert(key, settings, enumerated_rows)
+    if result is None:
+        return None
+    count, out, schema_triples, stats = result
 
-        return result
+    try:
+        spill_file = os.path.join(_worker_conversions[key]['spill_dir'], '{:010d}.part'.format(count))
+        with open(spill_file, 'wb') as f:
+            f.write(out)
     except:
         traceback.print_exc()
+        return None
 
+    return count, spill_file, schema_triples, stats
 
-class BurstConverter(object):
-    """The actual converter, that processes the chunk of lines from the CSV file, and uses the instructions from the ``schema`` graph to produce RDF."""
 
-    def __init__(self, identifier, columns, schema, metadata_graph, encoding, output_format):
-        self.ds = Dataset()
-        # self.ds = apply_default_namespaces(Dataset())
-        self.g = self.ds.graph(URIRef(identifier))
+def _buildSchema(kwargs):
+    """Builds a schema (see :func:`build_schema`) in a worker of a :class:`ConversionPool`, and returns the file name"""
+    build_schema(**kwargs)
+    return kwargs['outfile']
 
-        self.columns = columns
-        self.schema = schema
-        self.metadata_graph = metadata_graph
+
+class IRICache(object):
+    """Bounded (least recently used) cache that maps expanded URL patterns to validated IRIs.
+
+    Invalid IRIs are cached as well, so that they are not validated again either."""
+
+    def __init__(self, size=100000):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._iris = OrderedDict()
+
+    def to_iri(self, url):
+        """Returns the URIRef for ``url``, or raises an exception if it cannot be converted to a valid IRI"""
+        try:
+            iri = self._iris.pop(url)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            try:
+                iri = URIRef(iribaker.to_iri(url))
+                rfc3987.parse(iri, rule='IRI')
+            except:
+                iri = None
+
+            if len(self._iris) >= self.size > 0:
+                # Drop the least recently used IRI
+                self._iris.popitem(last=False)
+
+        if self.size > 0:
+            self._iris[url] = iri
+
+        if iri is None:
+            raise Exception(u"Cannot convert `{}` to valid IRI".format(url))
+        return iri
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+# The IRI cache of this (worker) process, it is kept across the chunks the process converts
+_iri_cache = None
+
+
+def get_iri_cache(size):
+    """Returns the IRI cache of the current process, with room for ``size`` IRIs"""
+    global _iri_cache
+    if _iri_cache is None or _iri_cache.size != size:
+        _iri_cache = IRICache(size)
+    return _iri_cache
+
+
+class TripleFilter(object):
+    """Remembers (at most ``size``) triples that were added to an assertion graph, so that triples that repeat across
+    chunks are only added once. Once it is full, triples it does not know are added again.
+
+    Each worker filters the schema derived triples of the chunks it converts, so that it only sends the new ones
+    back, and the parent process filters these again (see :meth:`CSVWConverter._write_schema_triples`), so that each
+    is written once."""
+
+    def __init__(self, identifier, size=100000):
+        self.identifier = identifier
+        self.size = size
+        self.suppressed = 0
+        self._triples = set()
+
+    def add(self, triple):
+        """Returns whether the ``triple`` should be added, i.e. whether it was not added before"""
+        if triple in self._triples:
+            self.suppressed += 1
+            return False
+        if len(self._triples) < self.size:
+            self._triples.add(triple)
+        return True
+
+
+def _recent(cache, key, factory):
+    """Returns the entry for ``key`` in the ``cache`` of (at most WORKER_CONVERSIONS) recent conversions,
+    or adds the result of ``factory`` to it"""
+    entry = cache.pop(key, None)
+    if entry is None:
+        entry = factory()
+        while len(cache) >= WORKER_CONVERSIONS:
+            cache.popitem(last=False)
+    cache[key] = entry
+    return entry
+
+
+# The filters of triples derived from the schema, by the conversions (and assertion graphs) this (worker) process
+# converts chunks for. Conversions of the same file in the same minute have the same assertion graph.
+_schema_triple_filters = OrderedDict()
+
+
+def get_schema_triple_filter(identifier, conversion=None):
+    """Returns the filter of schema derived triples of the current process, for the assertion graph ``identifier``
+    of the ``conversion`` (see :func:`_initWorker`)"""
+    return _recent(_schema_triple_filters, (conversion, identifier), lambda: TripleFilter(identifier))
+
+
+# The dictionaries of the terms written to binary output, by the conversions this process converts chunks for
+_term_dictionaries = OrderedDict()
+
+
+def get_term_dictionary(identifier, conversion=None):
+    """Returns the dictionary of the terms written to binary output by the current process (see :class:`TermDictionary`)"""
+    return _recent(_term_dictionaries, (conversion, identifier), TermDictionary)
+
+
+def log_iri_cache_stats(stats):
+    """Reports the IRI cache hits and misses of a conversion"""
+    total = stats['hits'] + stats['misses']
+    if total:
+        logger.info("IRI cache: {} hits, {} misses ({:.1f}% hit rate)".format(
+            stats['hits'], stats['misses'], 100.0 * stats['hits'] / total))
+
+
+def log_suppressed(suppressed):
+    """Reports the number of schema derived triples that were not written again"""
+    if suppressed:
+        logger.info("Suppressed {} repeated schema derived triples".format(suppressed))
+
+
+class BurstConverter(object):
+    """The actual converter, that processes the chunk of lines from the CSV file, and uses the instructions from the compiled ``plan`` (see :func:`compile_schema`) to produce RDF."""
+
+    def __init__(self, identifier, plan, encoding, output_format, iri_cache_size=100000, conversion=None):
+        if output_format == 'binary':
+            # The terms are numbered with the dictionary of this process, see DictionaryMerger
+            self.ds = self.g = DictionaryGraph(URIRef(identifier), get_term_dictionary(identifier, conversion))
+        elif output_format in STREAMING_FORMATS:
+            # Line based formats are written directly, without building an indexed rdflib store
+            self.ds = self.g = StreamingGraph(URIRef(identifier), output_format)
+        else:
+            self.ds = Dataset()
+            # self.ds = apply_default_namespaces(Dataset())
+            self.g = self.ds.graph(URIRef(identifier))
+
+        self.plan = plan
         self.encoding = encoding
         self.output_format = output_format
 
+        # Compiled patterns for patterns that are passed as strings to render_pattern
         self.templates = {}
 
-        self.aboutURLSchema = self.schema.csvw_aboutUrl
-
-    def equal_to_null(self, nulls, row):
+        self.iri_cache = get_iri_cache(iri_cache_size)
+        self._iri_cache_start = self.iri_cache.stats()
+        self.iri_cache_stats = {'hits': 0, 'misses': 0}
+
+        # Rows with their own subject cannot produce the triples of another row, so the graph does not have to
+        # remember these; only the triples of the current row are (the cells of a row can still repeat a triple)
+        self.unique_rows = isinstance(self.g, (StreamingGraph, DictionaryGraph)) and plan.about_url is not None and u'_row' in plan.about_url.pattern
+        self._row_seen = set()
+
+        self.schema_triples = get_schema_triple_filter(identifier, conversion)
+        self._suppressed_start = self.schema_triples.suppressed
+        self.suppressed = 0
+        # The schema derived triples of streamed chunks are returned separately, and written by the parent process
+        self.new_schema_triples = []
+        self._separate_schema_triples = isinstance(self.g, (StreamingGraph, DictionaryGraph))
+
+    def add(self, triple, unique=False):
+        """Adds the triple to the assertion graph, ``unique`` triples (of the subject of the current row) are only
+        checked for duplicates within the row, rather than by the :class:`StreamingGraph`"""
+        if unique and self.unique_rows:
+            if triple in self._row_seen:
+                return
+            self._row_seen.add(triple)
+            self.g.add(triple, unique=True)
+        else:
+            self.g.add(triple)
+
+    def add_schema_triple(self, triple):
+        """Adds a triple that follows from the schema rather than from the values of a single row (such as the type of a
+        code list), unless this process already added it while converting an earlier chunk (see :class:`TripleFilter`).
+        For streamed output, the triple is added to ``new_schema_triples`` instead of the graph, so that the parent
+        process can leave out the triples that other workers converted before."""
+        if self.schema_triples.add(triple):
+            if self._separate_schema_triples:
+                self.new_schema_triples.append(triple)
+            else:
+                self.g.add(triple)
+
+    def equal_to_null(self, null_conditions, row):
         """Determines whether a value in a cell matches a 'null' value as specified in the CSVW schema)"""
-        for n in nulls:
-            n = Item(self.metadata_graph, n)
-            col = str(n.csvw_name)
-            val = str(n.csvw_null)
-            if row[col] == val:
-                # logger.debug("Value of column {} ('{}') is equal to specified 'null' value: '{}'".format(col, unicode(row[col]).encode('utf-8'), val))
+        for col, val in null_conditions:
+            if row.get(col) == val:
                 # There is a match with null value
                 return True
         # There is no match with null value
@@ -499,286 +2269,584 @@ class BurstConverter(object):
     def process(self, count, rows, chunksize):
         """Process the rows fed to the converter. Count and chunksize are used to determine the
         current row number (needed for default observation identifiers)"""
-        obs_count = count * chunksize
+        self.convert_rows(rows, count * chunksize)
 
-        # logger.info("Row: {}".format(obs_count)) #removed for readability
+        # The IRI cache is shared between chunks, so only report the hits and misses of this one
+        self.iri_cache_stats = dict((k, v - self._iri_cache_start[k]) for k, v in self.iri_cache.stats().items())
+        self.suppressed = self.schema_triples.suppressed - self._suppressed_start
 
+        logger.info("... done")
+        return self.serialize()
+
+    def convert_rows(self, rows, obs_count):
+        """Adds the triples of the ``rows`` to the graph, numbering the rows from ``obs_count``"""
         # We iterate row by row, and then column by column, as given by the CSVW mapping file.
         mult_proc_counter = 0
-        iter_error_counter= 0
         for row in rows:
             # This fixes issue:10
             if row is None:
                 mult_proc_counter += 1
-                # logger.debug( #removed for readability
-                #     "Skipping empty row caused by multiprocessing (multiple of chunksize exceeds number of rows in file)...")
                 continue
 
             # set the '_row' value in case we need to generate 'default' URIs for each observation ()
-            # logger.debug("row: {}".format(obs_count)) #removed for readability
             row[u'_row'] = obs_count
-            count += 1
 
-            # print(row)
+            # default about URL
+            about = self.expandURL(self.plan.about_url, row)
+            self._row_seen.clear()
 
-            # The self.columns dictionary gives the mapping definition per column in the 'columns'
+            # The plan gives the mapping definition per column in the 'columns'
             # array of the CSVW tableSchema definition.
+            for c in self.plan.columns:
+                self.convert_cell(c, row, about)
 
-            for c in self.columns:
-                c = Item(self.metadata_graph, c)
-                # default about URL
-                s = self.expandURL(self.aboutURLSchema, row)
+            # We increment the observation (row number) with one
+            obs_count += 1
 
-                try:
-                    # Can also be used to prevent the triggering of virtual
-                    # columns!
-
-                    # Get the raw value from the cell in the CSV file
-                    try:
-                        # Python 2
-                        value = row[unicode(c.csvw_name)]
-                    except NameError:
-                        # Python 3
-                        value = row[str(c.csvw_name)]
-
-                    # This checks whether we should continue parsing this cell, or skip it.
-                    if self.isValueNull(value, c):
-                        continue
+        logger.debug(
+            "{} row skips caused by multiprocessing (multiple of chunksize exceeds number of rows in file)...".format(mult_proc_counter))
 
-                    # If the null values are specified in an array, we need to parse it as a collection (list)
-                    elif isinstance(c.csvw_null, Item):
-                        nulls = Collection(self.metadata_graph, BNode(c.csvw_null))
+    def convert_cell(self, c, row, about):
+        """Adds the triples for column ``c`` of the ``row`` (of which ``about`` is the default subject) to the graph"""
+        # Virtual columns (and columns missing from the CSV file) have no cell value
+        if c.name in row:
+            # This checks whether we should continue parsing this cell, or skip it.
+            if self.isValueNull(row[c.name], c):
+                return
 
-                        if self.equal_to_null(nulls, row):
-                            # Continue to next column specification in this row, if the value is equal to (one of) the null values.
-                            continue
-                except:
-                    # No column name specified (virtual) because there clearly was no c.csvw_name key in the row.
-                    # logger.debug(traceback.format_exc()) #removed for readability
-                    iter_error_counter +=1
-                    if isinstance(c.csvw_null, Item):
-                        nulls = Collection(self.metadata_graph, BNode(c.csvw_null))
-                        if self.equal_to_null(nulls, row):
-                            # Continue to next column specification in this row, if the value is equal to (one of) the null values.
-                            continue
+        if c.null_conditions and self.equal_to_null(c.null_conditions, row):
+            # Continue to next column specification in this row, if the value is equal to (one of) the null values.
+            return
 
-                try:
-                    # This overrides the subject resource 's' that has been created earlier based on the
-                    # schema wide aboutURLSchema specification.
-
-                    try:
-                        csvw_virtual = unicode(c.csvw_virtual)
-                        csvw_name = unicode(c.csvw_name)
-                        csvw_value = unicode(c.csvw_value)
-                        about_url = unicode(c.csvw_aboutUrl)
-                        value_url = unicode(c.csvw_valueUrl)
-                    except NameError:
-                        csvw_virtual = str(c.csvw_virtual)
-                        csvw_name = str(c.csvw_name)
-                        csvw_value = str(c.csvw_value)
-                        about_url = str(c.csvw_aboutUrl)
-                        value_url = str(c.csvw_valueUrl)
-
-                    if csvw_virtual == u'true' and c.csvw_aboutUrl is not None:
-                        s = self.expandURL(c.csvw_aboutUrl, row)
-
-                    if c.csvw_valueUrl is not None:
-                        # This is an object property, because the value needs to be cast to a URL
-                        p = self.expandURL(c.csvw_propertyUrl, row)
-                        o = self.expandURL(c.csvw_valueUrl, row)
-                        try:
-                            if self.isValueNull(os.path.basename(unicode(o)), c):
-                                logger.debug("skipping empty value")
-                                continue
-                        except NameError:
-                            if self.isValueNull(os.path.basename(str(o)), c):
-                                logger.debug("skipping empty value")
-                                continue
-
-                        if csvw_virtual == u'true' and c.csvw_datatype is not None and URIRef(c.csvw_datatype) == XSD.anyURI:
-                            # Special case: this is a virtual column with object values that are URIs
-                            # For now using a test special property
-                            value = row[unicode(c.csvw_name)].encode('utf-8')
-                            o = URIRef(iribaker.to_iri(value))
-
-                        if csvw_virtual == u'true' and c.csvw_datatype is not None and URIRef(c.csvw_datatype) == XSD.linkURI:
-                            about_url = about_url[about_url.find("{"):about_url.find("}")+1]
-                            s = self.expandURL(about_url, row)
-                            # logger.debug("s: {}".format(s))
-                            value_url = value_url[value_url.find("{"):value_url.find("}")+1]
-                            o = self.expandURL(value_url, row)
-                            # logger.debug("o: {}".format(o))
-
-                        # For coded properties, the collectionUrl can be used to indicate that the
-                        # value URL is a concept and a member of a SKOS Collection with that URL.
-                        if c.csvw_collectionUrl is not None:
-                            collection = self.expandURL(c.csvw_collectionUrl, row)
-                            self.g.add((collection, RDF.type, SKOS['Collection']))
-                            self.g.add((o, RDF.type, SKOS['Concept']))
-                            self.g.add((collection, SKOS['member'], o))
-
-                        # For coded properties, the schemeUrl can be used to indicate that the
-                        # value URL is a concept and a member of a SKOS Scheme with that URL.
-                        if c.csvw_schemeUrl is not None:
-                            scheme = self.expandURL(c.csvw_schemeUrl, row)
-                            self.g.add((scheme, RDF.type, SKOS['Scheme']))
-                            self.g.add((o, RDF.type, SKOS['Concept']))
-                            self.g.add((o, SKOS['inScheme'], scheme))
+        s = about
+        try:
+            # This overrides the subject resource 's' that has been created earlier based on the
+            # schema wide aboutURLSchema specification.
+            if c.virtual and c.about_url is not None:
+                s = self.expandURL(c.about_url, row)
+
+            if c.value_url is not None:
+                # This is an object property, because the value needs to be cast to a URL
+                p = self.expandURL(c.property_url, row)
+                o = self.expandURL(c.value_url, row)
+                if self.isValueNull(os.path.basename(o), c):
+                    logger.debug("skipping empty value")
+                    return
+
+                if c.virtual and c.is_uri:
+                    # Special case: this is a virtual column with object values that are URIs
+                    # For now using a test special property
+                    o = URIRef(iribaker.to_iri(row[c.name]))
+
+                if c.virtual and c.is_link:
+                    s = self.expandURL(c.link_about_url, row)
+                    o = self.expandURL(c.link_value_url, row)
+
+                # For coded properties, the collectionUrl can be used to indicate that the
+                # value URL is a concept and a member of a SKOS Collection with that URL.
+                if c.collection_url is not None:
+                    collection = self.expandURL(c.collection_url, row)
+                    self.add_schema_triple((collection, RDF.type, SKOS['Collection']))
+                    self.add_schema_triple((o, RDF.type, SKOS['Concept']))
+                    self.add_schema_triple((collection, SKOS['member'], o))
+
+                # For coded properties, the schemeUrl can be used to indicate that the
+                # value URL is a concept and a member of a SKOS Scheme with that URL.
+                if c.scheme_url is not None:
+                    scheme = self.expandURL(c.scheme_url, row)
+                    self.add_schema_triple((scheme, RDF.type, SKOS['Scheme']))
+                    self.add_schema_triple((o, RDF.type, SKOS['Concept']))
+                    self.add_schema_triple((o, SKOS['inScheme'], scheme))
+            else:
+                # This is a datatype property
+                if c.value is not None:
+                    value = self.render_pattern(c.value, row)
+                elif c.name is not None:
+                    value = row[c.name]
+                else:
+                    raise Exception("No 'name' or 'csvw:value' attribute found for this column specification")
+
+                # The propertyUrl defaults to the column name (see compile_schema)
+                p = self.expandURL(c.property_url, row)
+
+                if c.datatype is not None:
+                    if c.is_uri:
+                        # The xsd:anyURI datatype will be cast to a proper IRI resource.
+                        o = URIRef(iribaker.to_iri(value))
+                    elif c.has_lang:
+                        # If it is a string datatype that has a language, we turn it into a
+                        # language tagged literal
+                        # We also render the lang value in case it is a
+                        # pattern.
+                        o = Literal(value, lang=self.render_pattern(c.lang, row))
                     else:
-                        # This is a datatype property
-                        if c.csvw_value is not None:
-                            value = self.render_pattern(csvw_value, row)
-                        elif c.csvw_name is not None:
-                            # print s
-                            # print c.csvw_name, self.encoding
-                            # print row[unicode(c.csvw_name)], type(row[unicode(c.csvw_name)])
-                            # print row[unicode(c.csvw_name)].encode('utf-8')
-                            # print '...'
-                            value = row[csvw_name].encode('utf-8')
-                        else:
-                            raise Exception("No 'name' or 'csvw:value' attribute found for this column specification")
-
-                        # If propertyUrl is specified, use it, otherwise use
-                        # the column name
-                        if c.csvw_propertyUrl is not None:
-                            p = self.expandURL(c.csvw_propertyUrl, row)
-                        else:
-                            if "" in self.metadata_graph.namespaces():
-                                propertyUrl = self.metadata_graph.namespaces()[""][
-                                    csvw_name]
-                            else:
-                                propertyUrl = "{}{}".format(get_namespaces()['sdv'],
-                                    csvw_name)
-
-                            p = self.expandURL(propertyUrl, row)
-
-                        if c.csvw_datatype is not None:
-                            if URIRef(c.csvw_datatype) == XSD.anyURI:
-                                # The xsd:anyURI datatype will be cast to a proper IRI resource.
-                                o = URIRef(iribaker.to_iri(value))
-                            elif URIRef(c.csvw_datatype) == XSD.string and c.csvw_lang is not None:
-                                # If it is a string datatype that has a language, we turn it into a
-                                # language tagged literal
-                                # We also render the lang value in case it is a
-                                # pattern.
-                                o = Literal(value, lang=self.render_pattern(
-                                    c.csvw_lang, row))
-                            else:
-                                try:
-                                    csvw_datatype = unicode(c.csvw_datatype)
-                                except NameError:
-                                    csvw_datatype = str(c.csvw_datatype).split(')')[0].split('(')[-1]
-                                    # csvw_datatype = str(c.csvw_datatype)
-                                # print(type(csvw_datatype))
-                                # print(csvw_datatype)
-                                o = Literal(value, datatype=csvw_datatype, normalize=False)
-                        else:
-                            # It's just a plain literal without datatype.
-                            o = Literal(value)
-
-
-                    # Add the triple to the assertion graph
-                    self.g.add((s, p, o))
-
-                    # Add provenance relating the propertyUrl to the column id
-                    if '@id' in c:
-                        self.g.add((p, PROV['wasDerivedFrom'], URIRef(c['@id'])))
-
-                except:
-                    # print row[0], value
-                    traceback.print_exc()
+                        o = Literal(value, datatype=c.datatype, normalize=False)
+                else:
+                    # It's just a plain literal without datatype.
+                    o = Literal(value)
 
-            # We increment the observation (row number) with one
-            obs_count += 1
+            # Add the triple to the assertion graph
+            self.add((s, p, o), unique=s is about)
 
-        # for s,p,o in self.g.triples((None,None,None)):
-        #     print(s.__repr__,p.__repr__,o.__repr__)
+            # Add provenance relating the propertyUrl to the column id
+            if c.identifier is not None:
+                self.add_schema_triple((p, PROV['wasDerivedFrom'], c.identifier))
 
-        logger.debug(
-            "{} row skips caused by multiprocessing (multiple of chunksize exceeds number of rows in file)...".format(mult_proc_counter))
-        logger.debug(
-            "{} errors encountered while trying to iterate over a NoneType...".format(mult_proc_counter))
-        logger.info("... done")
-        return self.ds.serialize(format=self.output_format)
+        except:
+            traceback.print_exc()
 
-    # def serialize(self):
-    #     trig_file_name = self.file_name + '.trig'
-    #     logger.info("Starting serialization to {}".format(trig_file_name))
-    #
-    #     with open(trig_file_name, 'w') as f:
-    #         self.np.serialize(f, format='trig')
-    #     logger.info("... done")
+    def serialize(self):
+        """Serializes the converted rows in the output format"""
+        return self.ds.serialize(format=self.output_format)
 
     def render_pattern(self, pattern, row):
-        """Takes a Jinja or Python formatted string, and applies it to the row value"""
-        # Significant speedup by not re-instantiating Jinja templates for every
-        # row.
+        """Takes a compiled pattern (see :func:`compile_pattern`), or a Jinja or Python formatted string, and applies it to the row value"""
+        if not callable(pattern):
+            # Significant speedup by not re-instantiating Jinja templates for every
+            # row.
+            if pattern in self.templates:
+                pattern = self.templates[pattern]
+            else:
+                pattern = self.templates[pattern] = compile_pattern(pattern)
+
+        return pattern(row)
+
+    def expandURL(self, url_pattern, row, datatype=False):
+        """Takes a Jinja or Python formatted string, applies it to the row values, and returns it as a URIRef"""
+
+        url = self.render_pattern(url_pattern, row)
+
+        return self.iri_cache.to_iri(url)
+
+    def isValueNull(self, value, c):
+        """This checks whether we should continue parsing this cell, or skip it because it is empty or a null value."""
+        if len(value) == 0:
+            # Empty values are skipped, unless the column says otherwise
+            return not c.parse_on_empty
+        # Skip value if it is equal to (one of) the null value(s)
+        return value in c.nulls
+
+
+# The number of rows the ColumnarConverter converts a column at a time
+COLUMNAR_BATCH_SIZE = 5000
 
-        if pattern in self.templates:
-            template = self.templates[pattern]
+
+def _is_columnar_pattern(pattern):
+    """Determines whether the (compiled) ``pattern`` can be rendered for all rows of a column at once, i.e. whether it
+    is a :class:`ConstantPattern` or a :class:`FormatPattern` with only plain ``{column}`` placeholders"""
+    return isinstance(pattern, ConstantPattern) or (isinstance(pattern, FormatPattern) and pattern.simple)
+
+
+def is_columnar(c):
+    """Determines whether the :class:`ColumnPlan` ``c`` can be converted a column at a time by the :class:`ColumnarConverter`"""
+    return (not c.virtual and c.name is not None and c.value is None and not c.has_lang and not c.is_uri
+            and not c.is_link and isinstance(c.property_url, ConstantPattern)
+            and all(_is_columnar_pattern(p) for p in (c.value_url, c.collection_url, c.scheme_url) if p is not None))
+
+
+class ColumnarConverter(BurstConverter):
+    """
+    A :class:`BurstConverter` for N-Quads and N-Triples that converts batches of rows a column at a time: it applies the
+    null values, renders the aboutUrl and valueUrl patterns and formats the literals of all rows of a batch at once,
+    and then writes the lines row by row (in the same order, and with the same deduplication, as the BurstConverter).
+
+    Columns that need Jinja templates, virtual column logic, language tags or IRI datatypes (see :func:`is_columnar`)
+    are converted cell by cell, as are batches with missing values. The output is identical to that of the BurstConverter.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ColumnarConverter, self).__init__(*args, **kwargs)
+        # Which columns can be converted a column at a time, or None if the rows have to be converted one by one
+        self.columnar = None
+        if self.output_format in ('nquads', 'nt') and _is_columnar_pattern(self.plan.about_url):
+            self.columnar = [is_columnar(c) for c in self.plan.columns]
+
+    def add(self, triple, unique=False):
+        # The triples of cells converted one by one are deduplicated as lines, like those converted a column at a time
+        if unique and self.unique_rows:
+            s, p, o = triple
+            self.add_row_line(u'%s %s %s%s' % (quote_term(s), quote_term(p), quote_term(o), self.g.line_suffix))
         else:
-            template = self.templates[pattern] = Template(pattern)
+            self.g.add(triple)
+
+    def add_row_line(self, line):
+        """Adds a ``line`` of the subject of the current row, unless the row already produced it"""
+        if line not in self._row_seen:
+            self._row_seen.add(line)
+            self.g.add_line(line, True)
+
+    def convert_rows(self, rows, obs_count):
+        if self.columnar is None:
+            return super(ColumnarConverter, self).convert_rows(rows, obs_count)
+
+        rows = (row for row in rows if row is not None)
+        while True:
+            batch = list(islice(rows, COLUMNAR_BATCH_SIZE))
+            if not batch:
+                break
+            if not self.convert_batch(batch, obs_count):
+                super(ColumnarConverter, self).convert_rows(batch, obs_count)
+            obs_count += len(batch)
+
+    def convert_batch(self, batch, obs_count):
+        """Converts the rows of the ``batch`` (numbered from ``obs_count``) a column at a time. Returns False, without
+        converting anything, if the aboutUrl cannot be rendered for the batch (because of missing values)."""
+        size = len(batch)
+        for i, row in enumerate(batch):
+            row[u'_row'] = obs_count + i
+        columns = {u'_row': list(range(obs_count, obs_count + size))}
+
+        def column(name):
+            """Returns the values of the column ``name``, or raises a KeyError if it has missing values"""
+            try:
+                return columns[name]
+            except KeyError:
+                values = columns[name] = [row[name] for row in batch]
+                if None in values:
+                    raise KeyError(name)
+                return values
+
+        try:
+            urls = self.render_column(self.plan.about_url, column, size)
+        except KeyError:
+            return False
+        to_iri = self.iri_cache.to_iri
+        abouts = [to_iri(url) for url in urls]
+
+        # The (cells, wasDerivedFrom triple) of every column, or None for those that are converted cell by cell
+        converted = []
+        for c, columnar in zip(self.plan.columns, self.columnar):
+            converted.append(self.convert_column(c, column, size, batch[0]) if columnar else None)
+
+        add_line = self.add_row_line if self.unique_rows else self.g.add_line
+        add_schema_triple = self.add_schema_triple
+        for i, row in enumerate(batch):
+            about = abouts[i]
+            subject = u'<%s>' % about
+            self._row_seen.clear()
+            for c, cells in zip(self.plan.columns, converted):
+                if cells is None:
+                    self.convert_cell(c, row, about)
+                    continue
+
+                cell = cells[0][i]
+                if cell is None:
+                    continue
+                schema_triples, line = cell
+                for triple in schema_triples:
+                    add_schema_triple(triple)
+                add_line(subject + line)
+                if cells[1] is not None:
+                    add_schema_triple(cells[1])
+        return True
+
+    def convert_column(self, c, column, size, first_row):
+        """Returns, for the rows of the batch, the schema derived triples and the line (without its subject) of column
+        ``c``, or None for the cells that are skipped. Returns None if the column has to be converted cell by cell."""
+        to_iri = self.iri_cache.to_iri
+        try:
+            values = column(c.name)
+            p = to_iri(c.property_url.pattern)
+            conditions = [(column(name), value) for name, value in c.null_conditions if name in first_row]
+            value_urls = collections = schemes = None
+            if c.value_url is not None:
+                value_urls = self.render_column(c.value_url, column, size)
+                if c.collection_url is not None:
+                    collections = self.render_column(c.collection_url, column, size)
+                if c.scheme_url is not None:
+                    schemes = self.render_column(c.scheme_url, column, size)
+        except Exception:
+            return None
+
+        # The cells that are not empty or null (see isValueNull and equal_to_null)
+        nulls = c.nulls
+        keep = [(value not in nulls) if value else c.parse_on_empty for value in values]
+        for condition_values, null_value in conditions:
+            keep = [k and value != null_value for k, value in zip(keep, condition_values)]
+
+        derived = None
+        if c.identifier is not None:
+            derived = (p, PROV['wasDerivedFrom'], c.identifier)
+
+        suffix = self.g.line_suffix
+        predicate = u' <%s> ' % p
+        if value_urls is None:
+            # Literals
+            datatype = u'' if c.datatype is None else u'^^<%s>' % c.datatype
+            lines = [((), predicate + quote_lexical(value) + datatype + suffix) if k else None
+                     for k, value in zip(keep, values)]
+            return lines, derived
+
+        lines = []
+        for i, k in enumerate(keep):
+            if not k:
+                lines.append(None)
+                continue
+            try:
+                o = to_iri(value_urls[i])
+                if self.isValueNull(os.path.basename(o), c):
+                    logger.debug("skipping empty value")
+                    lines.append(None)
+                    continue
+
+                schema_triples = []
+                if collections is not None:
+                    collection = to_iri(collections[i])
+                    schema_triples += [(collection, RDF.type, SKOS['Collection']),
+                                       (o, RDF.type, SKOS['Concept']),
+                                       (collection, SKOS['member'], o)]
+                if schemes is not None:
+                    scheme = to_iri(schemes[i])
+                    schema_triples += [(scheme, RDF.type, SKOS['Scheme']),
+                                       (o, RDF.type, SKOS['Concept']),
+                                       (o, SKOS['inScheme'], scheme)]
+                lines.append((schema_triples, u'%s<%s>%s' % (predicate, o, suffix)))
+            except:
+                traceback.print_exc()
+                lines.append(None)
+        return lines, derived
+
+    def render_column(self, pattern, column, size):
+        """Renders a :class:`ConstantPattern` or plain :class:`FormatPattern` for all ``size`` rows of a batch at once,
+        using ``column`` to get the values of the columns it uses"""
+        if isinstance(pattern, ConstantPattern):
+            return [pattern.pattern] * size
+
+        fields = [column(field) for literal, field in pattern.parts if field is not None]
+        template = u''.join(literal.replace(u'{', u'{{').replace(u'}', u'}}') + (u'' if field is None else u'{}')
+                            for literal, field in pattern.parts)
+        if not fields:
+            return [template.format()] * size
+        return [template.format(*values) for values in zip(*fields)]
+
 
-        # TODO This should take into account the special CSVW instructions such as {_row}
-        # First we interpret the url_pattern as a Jinja2 template, and pass all
-        # column/value pairs as arguments
-        # row = {str('Int'): int('104906'), str('Country'): str('Luxembourg'), str('_row'): 1, str('Rank'): str('2')}
+class StageTimes(object):
+    """Accumulates the time spent in (and the number of times through) the stages of a conversion"""
 
-        # print(pattern)
-        # print(type(pattern))
-        # print(row)
-        # print(type(row))
-        # rendered_template = template.render(Int=120000)
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
 
-        rendered_template = template.render(**row)
+    def add(self, stage, seconds, calls=1):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + calls
 
+    @contextmanager
+    def time(self, stage):
+        start = timeit.default_timer()
         try:
-            # We then format the resulting string using the standard Python2
-            # expressions
-            return rendered_template.format(**row)
-        except:
-            logger.warning(
-                u"Could not apply python string formatting, probably due to mismatched curly brackets. IRI will be '{}'. ".format(rendered_template))
-            return rendered_template
+            yield
+        finally:
+            self.add(stage, timeit.default_timer() - start)
+
+    def timed(self, iterable, stage):
+        """Generates the items of ``iterable``, adding the time spent waiting for each of them to ``stage``"""
+        iterator = iter(iterable)
+        while True:
+            start = timeit.default_timer()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(stage, timeit.default_timer() - start)
+            yield item
+
+    def merge(self, other):
+        """Adds the stages of ``other`` (as returned by :meth:`as_dict`) to these"""
+        for stage, times in other.items():
+            self.add(stage, times['seconds'], times['calls'])
+
+    def as_dict(self):
+        return dict((stage, {'seconds': round(self.seconds[stage], 6), 'calls': self.calls[stage]})
+                    for stage in self.seconds)
+
+
+@contextmanager
+def _no_stage():
+    yield
+
+
+class _TimedConverter(object):
+    """Keeps track of the time a converter spends reading rows, rendering patterns, validating IRIs, adding triples
+    to the graph and serializing it (see :class:`StageTimes`). The remainder of the time spent in :meth:`process`
+    is reported as ``other``."""
+
+    def __init__(self, *args, **kwargs):
+        super(_TimedConverter, self).__init__(*args, **kwargs)
+        self.times = StageTimes()
+        self.g = _TimedGraph(self.g, self.times)
+        if self.ds is self.g._graph:
+            self.ds = self.g
+
+    def process(self, count, rows, chunksize):
+        start = timeit.default_timer()
+        result = super(_TimedConverter, self).process(count, self.times.timed(rows, 'read'), chunksize)
+        self.times.add('total', timeit.default_timer() - start)
+        return result
+
+    def serialize(self):
+        with self.times.time('serialize'):
+            return super(_TimedConverter, self).serialize()
+
+    def render_pattern(self, pattern, row):
+        start = timeit.default_timer()
+        result = super(_TimedConverter, self).render_pattern(pattern, row)
+        self.times.add('render', timeit.default_timer() - start)
+        return result
 
     def expandURL(self, url_pattern, row, datatype=False):
-        """Takes a Jinja or Python formatted string, applies it to the row values, and returns it as a URIRef"""
+        url = self.render_pattern(url_pattern, row)
 
-        try:
-            unicode_url_pattern = unicode(url_pattern)
-        except NameError:
-            unicode_url_pattern = str(url_pattern).split(')')[0].split('(')[-1]
-        # print(unicode_url_pattern)
+        start = timeit.default_timer()
+        iri = self.iri_cache.to_iri(url)
+        self.times.add('iri', timeit.default_timer() - start)
+        return iri
 
-        url = self.render_pattern(unicode_url_pattern, row)
+    def profile_stats(self, profiler):
+        """Returns the stage times, and the tracemalloc results of the ``profiler`` (a :class:`ChunkProfiler`)"""
+        stages = self.times.as_dict()
+        other = stages['total']['seconds'] - sum(t['seconds'] for stage, t in stages.items() if stage != 'total')
+        stages['other'] = {'seconds': round(max(other, 0.0), 6), 'calls': 1}
+        stats = {'stages': stages}
+        stats.update(profiler.stats())
+        return stats
 
-        # DEPRECATED
-        # for ns, nsuri in namespaces.items():
-        #     if url.startswith(ns):
-        #         url = url.replace(ns + ':', nsuri)
-        #         break
 
-        try:
-            iri = iribaker.to_iri(url)
-            rfc3987.parse(iri, rule='IRI')
-        except:
-            raise Exception(u"Cannot convert `{}` to valid IRI".format(url))
+class TimedBurstConverter(_TimedConverter, BurstConverter):
+    """A :class:`BurstConverter` that keeps track of the time spent in the stages of the conversion"""
 
-        # print(iri)
-        return URIRef(iri)
 
-    def isValueNull(self, value, c):
-        """This checks whether we should continue parsing this cell, or skip it because it is empty or a null value."""
-        try:
-            if len(value) == 0 and unicode(c.csvw_parseOnEmpty) == u"true":
-                # print("Not skipping empty value")
-                return False #because it should not be skipped
-            elif len(value) == 0 or value == unicode(c.csvw_null) or value in [unicode(n) for n in c.csvw_null] or value == unicode(self.schema.csvw_null):
-                # Skip value if length is zero and equal to (one of) the null value(s)
-                # logger.debug(
-                #     "Length is 0 or value is equal to specified 'null' value")
-                return True
-        except:
-            # logger.debug("null does not exist or is not a list.") #this line will print for every cell in a csv without a defined null value.
-            pass
-        return False
+class TimedColumnarConverter(_TimedConverter, ColumnarConverter):
+    """A :class:`ColumnarConverter` that keeps track of the time spent in the stages of the conversion. The IRIs of
+    the columns that are converted a column at a time are validated as part of ``other``."""
+
+    def render_column(self, pattern, column, size):
+        start = timeit.default_timer()
+        result = super(TimedColumnarConverter, self).render_column(pattern, column, size)
+        self.times.add('render', timeit.default_timer() - start)
+        return result
+
+
+class _TimedGraph(object):
+    """Wraps the graph of a timed converter (see :class:`_TimedConverter`) to time adding triples and lines to it"""
+
+    def __init__(self, graph, times):
+        self._graph = graph
+        self._times = times
+
+    def add(self, *args, **kwargs):
+        start = timeit.default_timer()
+        self._graph.add(*args, **kwargs)
+        self._times.add('graph', timeit.default_timer() - start)
+
+    def add_line(self, *args, **kwargs):
+        start = timeit.default_timer()
+        self._graph.add_line(*args, **kwargs)
+        self._times.add('graph', timeit.default_timer() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._graph, name)
+
+
+class ChunkProfiler(object):
+    """Optionally runs cProfile or tracemalloc while converting chunks (in a worker process). cProfile statistics
+    are dumped to a file per process in ``directory`` after every chunk."""
+
+    def __init__(self, profiler=None, directory=None):
+        self.profiler = profiler
+        self.directory = directory
+        self._cprofile = None
+        if profiler == 'cprofile':
+            self._cprofile = cProfile.Profile()
+        elif profiler == 'tracemalloc':
+            if tracemalloc is None:
+                logger.warning("tracemalloc is not available in this version of Python")
+                self.profiler = None
+            elif not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    def __enter__(self):
+        if self._cprofile is not None:
+            self._cprofile.enable()
+        return self
+
+    def __exit__(self, *args):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(os.path.join(self.directory, '{}.prof'.format(os.getpid())))
+
+    def stats(self):
+        """Returns the peak traced memory and the largest allocation sites of this process (when using tracemalloc)"""
+        if self.profiler != 'tracemalloc':
+            return {}
+        _, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+        return {'tracemalloc': {
+            'pid': os.getpid(),
+            'peak_kb': peak // 1024,
+            'top': [[u'{}:{}'.format(stat.traceback[0].filename, stat.traceback[0].lineno), stat.size // 1024]
+                    for stat in top]
+        }}
+
+
+class ConversionProfile(object):
+    """The timings of the conversion stages in the parent process, and those of the chunks (aggregated over the
+    worker processes), see :meth:`CSVWConverter.write_profile`"""
+
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+        self.directory = tempfile.mkdtemp(prefix='cow-profile-') if profiler == 'cprofile' else None
+        self.parent = StageTimes()
+        self.workers = StageTimes()
+        self.chunks = 0
+        self.tracemalloc = {}
+        # The metrics of the AsyncWriter and the GraphStoreUploader
+        self.writer = None
+        self.upload = None
+        self._start = timeit.default_timer()
+
+    def add_chunk(self, stats):
+        self.chunks += 1
+        self.workers.merge(stats['stages'])
+        if 'tracemalloc' in stats:
+            # Keep the latest results of every process
+            self.tracemalloc[stats['tracemalloc']['pid']] = stats['tracemalloc']
+
+    def report(self, prof_file, functions=30):
+        """Returns the report as a dictionary, and writes the merged cProfile statistics (if any) to ``prof_file``"""
+        report = {
+            'seconds': round(timeit.default_timer() - self._start, 6),
+            'chunks': self.chunks,
+            'parent': self.parent.as_dict(),
+            'workers': self.workers.as_dict()
+        }
+
+        if self.writer is not None:
+            report['writer'] = self.writer
+        if self.upload is not None:
+            report['upload'] = self.upload
+
+        if self.tracemalloc:
+            report['tracemalloc'] = {
+                'peak_kb': max(t['peak_kb'] for t in self.tracemalloc.values()),
+                'processes': sorted(self.tracemalloc.values(), key=lambda t: t['pid'])
+            }
+
+        if self.directory is not None:
+            files = [os.path.join(self.directory, f) for f in os.listdir(self.directory)]
+            if files:
+                stats = pstats.Stats(*files)
+                stats.dump_stats(prof_file)
+                report['cprofile'] = {'file': prof_file, 'functions': []}
+                # The functions with the largest cumulative time
+                for function, (_, calls, tottime, cumtime, _) in sorted(
+                        stats.stats.items(), key=lambda item: -item[1][3])[:functions]:
+                    report['cprofile']['functions'].append({
+                        'function': u'{}:{}({})'.format(*function),
+                        'calls': calls,
+                        'tottime': round(tottime, 6),
+                        'cumtime': round(cumtime, 6)
+                    })
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+        return report
@@ -0,0 +1,455 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+A long-running conversion service (``cow_tool serve``). The CSV files are converted by a pool of worker processes
+that is started once, with the schemas loaded and compiled once, instead of every conversion paying for starting
+Python, importing rdflib and starting a pool of its own. The service speaks HTTP, on a TCP port or a Unix socket:
+
+* ``POST /schemas`` with a JSON-LD CSVW schema as the body stores the schema, and returns its id (its git hash).
+* ``POST /jobs?schema=<id>&name=<file name>&format=<format>`` with a CSV file as the body queues the conversion
+  of the file, and returns the job (or 503 if the queue is full).
+* ``GET /jobs/<id>`` returns the status of a job, ``GET /jobs/<id>/output`` waits for the job to finish and
+  streams the RDF, and ``DELETE /jobs/<id>`` removes a finished job and its files.
+* ``POST /convert?schema=<id>&name=<file name>&format=<format>`` converts the CSV file in the body like
+  ``POST /jobs``, and streams the RDF once it is converted.
+* ``GET /status`` returns the numbers of queued, running and finished jobs.
+
+For example:
+
+    curl --data-binary @myfile.csv-metadata.json http://localhost:8080/schemas
+    curl --data-binary @myfile.csv 'http://localhost:8080/convert?schema=<id>&name=myfile.csv'
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import shutil
+import signal
+import logging
+import tempfile
+import threading
+import traceback
+from rdflib import Graph
+
+try:
+    # Python 3
+    from queue import Queue, Full, Empty
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn, UnixStreamServer
+    from urllib.parse import urlsplit, parse_qs
+except ImportError:
+    # Python 2
+    from Queue import Queue, Full, Empty
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+    from urlparse import urlsplit, parse_qs
+
+try:
+    # Python 2
+    from csvw import CSVWConverter, ConversionPool, load_schema
+    from util import git_hash_file
+except ImportError:
+    from .csvw import CSVWConverter, ConversionPool, load_schema
+    from .util import git_hash_file
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# The media types of the output formats (only formats that are written chunk by chunk can be served)
+CONTENT_TYPES = {
+    'nquads': 'application/n-quads',
+    'nt': 'application/n-triples',
+    'turtle': 'text/turtle',
+    'trig': 'application/trig',
+    'binary': 'application/octet-stream'
+}
+
+# The size of the blocks in which uploaded files are stored and the output is sent
+BLOCK_SIZE = 64 * 1024
+
+
+class ServiceError(Exception):
+    """An error in a request, with the HTTP ``status`` to respond with"""
+
+    def __init__(self, status, message):
+        super(ServiceError, self).__init__(message)
+        self.status = status
+
+
+class ConversionJob(object):
+    """The conversion of the CSV file ``name`` (stored in ``directory``) with a stored schema"""
+
+    def __init__(self, directory, name, schema_file_name, output_format):
+        self.id = os.path.basename(directory)
+        self.directory = directory
+        self.name = name
+        self.file_name = os.path.join(directory, name)
+        self.schema_file_name = schema_file_name
+        self.output_format = output_format
+        self.target_file = None
+        self.status = 'queued'
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # Set once the job is done or failed
+        self.done = threading.Event()
+
+    def stats(self):
+        stats = {
+            'job': self.id,
+            'name': self.name,
+            'format': self.output_format,
+            'status': self.status
+        }
+        if self.started is not None:
+            stats['queued_seconds'] = round(self.started - self.submitted, 6)
+        if self.finished is not None:
+            stats['conversion_seconds'] = round(self.finished - self.started, 6)
+        if self.target_file is not None:
+            stats['output_bytes'] = os.path.getsize(self.target_file)
+        if self.error is not None:
+            stats['error'] = self.error
+        return stats
+
+
+class ConversionService(object):
+    """
+    Converts the CSV files submitted as jobs with the schemas added to the service, in a :class:`ConversionPool`
+    of ``processes`` processes (or in the thread of the job, with a single process). At most ``concurrency`` jobs
+    are converted at the same time (one at a time with a single process, as conversions in the same process share
+    their worker state), and at most ``queue_size`` jobs wait for their turn. The schemas and files are
+    stored in ``directory`` (a temporary directory by default), and the files of all but the last ``keep_jobs``
+    finished jobs are removed.
+    """
+
+    def __init__(self, processes=4, concurrency=None, queue_size=100, chunksize=5000, output_format='nquads',
+                 iri_cache_size=100000, directory=None, keep_jobs=100):
+        if output_format not in CONTENT_TYPES:
+            raise ValueError("Cannot serve {} output, use one of {}".format(output_format, ', '.join(sorted(CONTENT_TYPES))))
+
+        self.processes = processes
+        self.concurrency = max(1, concurrency or processes)
+        if processes <= 1 and self.concurrency > 1:
+            logger.warning("Converting one file at a time, as the conversions run in a single process")
+            self.concurrency = 1
+        self.queue_size = max(1, queue_size)
+        self.chunksize = chunksize
+        self.output_format = output_format
+        self.iri_cache_size = iri_cache_size
+        self.keep_jobs = keep_jobs
+
+        self._temporary = directory is None
+        self.directory = tempfile.mkdtemp(prefix='cow-serve-') if directory is None else directory
+        for subdirectory in ('schemas', 'jobs'):
+            if not os.path.exists(os.path.join(self.directory, subdirectory)):
+                os.makedirs(os.path.join(self.directory, subdirectory))
+
+        # Load the JSON-LD parser now, rather than when the first schema comes in
+        Graph().parse(data='{}', format='json-ld')
+
+        # The workers are started (forked) once, with everything imported
+        self.pool = ConversionPool(processes) if processes > 1 else None
+
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._queue = Queue(maxsize=self.queue_size)
+        self._threads = []
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name='cow-job-{}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def add_schema(self, stream, length):
+        """Stores the schema of ``length`` bytes read from ``stream``, and returns its id"""
+        schemas = os.path.join(self.directory, 'schemas')
+        handle, temporary_file = tempfile.mkstemp(prefix='.upload-', dir=schemas)
+        with os.fdopen(handle, 'wb') as f:
+            _copy(stream, f, length)
+
+        schema_hash = git_hash_file(temporary_file)
+        schema_file_name = os.path.join(schemas, schema_hash + '-metadata.json')
+        if os.path.exists(schema_file_name):
+            os.remove(temporary_file)
+            return schema_hash
+        os.rename(temporary_file, schema_file_name)
+        try:
+            # Parse the schema once now, so that the jobs use the cached one
+            load_schema(schema_file_name, schema_hash)
+        except Exception as e:
+            os.remove(schema_file_name)
+            raise ServiceError(400, "Cannot load the schema: {}".format(e))
+        logger.info("Added schema {}".format(schema_hash))
+        return schema_hash
+
+    def submit(self, stream, length, schema, name=None, output_format=None):
+        """Stores the CSV file ``name`` of ``length`` bytes read from ``stream``, and queues its conversion with
+        the ``schema`` (an id returned by :meth:`add_schema`) to ``output_format``. Returns the job."""
+        if schema is None or not re.match(r'^[0-9a-f]{40}$', schema):
+            raise ServiceError(400, "Give the id of a schema added before with schema=<id>")
+        schema_file_name = os.path.join(self.directory, 'schemas', schema + '-metadata.json')
+        if not os.path.exists(schema_file_name):
+            raise ServiceError(404, "Unknown schema {}".format(schema))
+
+        output_format = output_format or self.output_format
+        if output_format not in CONTENT_TYPES:
+            raise ServiceError(400, "Cannot serve {} output, use one of {}".format(output_format, ', '.join(sorted(CONTENT_TYPES))))
+
+        # The name of the file determines the names of the graphs
+        name = re.sub(r'[^A-Za-z0-9._-]', '_', os.path.basename(name or ''))
+        if not name.strip('.'):
+            name = 'data.csv'
+
+        if self._queue.full():
+            raise ServiceError(503, "The queue of {} jobs is full".format(self.queue_size))
+
+        directory = os.path.join(self.directory, 'jobs', uuid.uuid4().hex)
+        os.makedirs(directory)
+        job = ConversionJob(directory, name, schema_file_name, output_format)
+        try:
+            with open(job.file_name, 'wb') as f:
+                _copy(stream, f, length)
+            with self._lock:
+                self.jobs[job.id] = job
+            self._queue.put_nowait(job)
+        except Full:
+            self._remove(job)
+            raise ServiceError(503, "The queue of {} jobs is full".format(self.queue_size))
+        except:
+            self._remove(job)
+            raise
+
+        logger.info("Queued job {} for {} ({} bytes)".format(job.id, name, length))
+        return job
+
+    def job(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise ServiceError(404, "Unknown job {}".format(job_id))
+        return job
+
+    def remove(self, job_id):
+        """Removes the finished job ``job_id`` and its files"""
+        job = self.job(job_id)
+        if not job.done.is_set():
+            raise ServiceError(409, "Job {} is not finished yet".format(job_id))
+        self._remove(job)
+
+    def _remove(self, job):
+        with self._lock:
+            self.jobs.pop(job.id, None)
+        shutil.rmtree(job.directory, ignore_errors=True)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+
+            job.status = 'running'
+            job.started = time.time()
+            try:
+                c = CSVWConverter(job.file_name, processes=self.processes, chunksize=self.chunksize,
+                                  output_format=job.output_format, iri_cache_size=self.iri_cache_size, force=True,
+                                  pool=self.pool, schema=job.schema_file_name)
+                c.convert()
+                job.target_file = c.target_file
+                job.status = 'done'
+            except Exception as e:
+                logger.error("Could not convert job {}: {}".format(job.id, e))
+                traceback.print_exc()
+                job.error = "{}: {}".format(type(e).__name__, e)
+                job.status = 'failed'
+            finally:
+                job.finished = time.time()
+                job.done.set()
+            logger.info("Job {} {} in {:.3f} s".format(job.id, job.status, job.finished - job.started))
+            self._prune()
+
+    def _prune(self):
+        """Removes the oldest finished jobs, but the last ``keep_jobs``"""
+        with self._lock:
+            finished = sorted((job for job in self.jobs.values() if job.done.is_set()), key=lambda job: job.finished)
+        for job in finished[:max(0, len(finished) - self.keep_jobs)]:
+            self._remove(job)
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {
+            'processes': self.processes,
+            'concurrency': self.concurrency,
+            'queue_size': self.queue_size,
+            'queued': statuses.count('queued'),
+            'running': statuses.count('running'),
+            'done': statuses.count('done'),
+            'failed': statuses.count('failed'),
+            'schemas': len([f for f in os.listdir(os.path.join(self.directory, 'schemas')) if not f.startswith('.')])
+        }
+
+    def close(self):
+        """Fails the queued jobs, waits for the running ones, and stops the workers (and removes the temporary
+        directory)"""
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except Empty:
+                break
+            if job is not None:
+                job.error = "The service stopped"
+                job.status = 'failed'
+                job.done.set()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self.pool is not None:
+            self.pool.close()
+        if self._temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _copy(stream, f, length):
+    """Copies ``length`` bytes from ``stream`` to the file ``f``"""
+    remaining = length
+    while remaining > 0:
+        data = stream.read(min(BLOCK_SIZE, remaining))
+        if not data:
+            raise ServiceError(400, "The body ended after {} of {} bytes".format(length - remaining, length))
+        f.write(data)
+        remaining -= len(data)
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """Handles the requests to the :class:`ConversionService` of the server (see the module documentation)"""
+
+    server_version = 'cow'
+    # Keep-alive connections, for clients that submit many small files
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        service = self.server.service
+        url = urlsplit(self.path)
+        params = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+        path = url.path.rstrip('/').split('/')[1:]
+        try:
+            if method == 'POST' and path == ['schemas']:
+                self._send_json(201, {'schema': service.add_schema(self.rfile, self._content_length())})
+            elif method == 'POST' and path in (['jobs'], ['convert']):
+                job = service.submit(self.rfile, self._content_length(), params.get('schema'), params.get('name'),
+                                     params.get('format'))
+                if path == ['jobs']:
+                    self._send_json(202, job.stats())
+                else:
+                    try:
+                        self._send_output(job)
+                    finally:
+                        job.done.wait()
+                        service.remove(job.id)
+            elif method == 'GET' and path == ['status']:
+                self._send_json(200, service.stats())
+            elif method == 'GET' and len(path) == 2 and path[0] == 'jobs':
+                self._send_json(200, service.job(path[1]).stats())
+            elif method == 'GET' and len(path) == 3 and path[0] == 'jobs' and path[2] == 'output':
+                self._send_output(service.job(path[1]))
+            elif method == 'DELETE' and len(path) == 2 and path[0] == 'jobs':
+                service.remove(path[1])
+                self._send_json(200, {'job': path[1], 'status': 'removed'})
+            else:
+                raise ServiceError(404, "Unknown request {} {}".format(method, url.path))
+        except ServiceError as e:
+            # The body of the request may not have been read
+            self.close_connection = True
+            self._send_json(e.status, {'error': str(e)})
+        except (IOError, OSError) as e:
+            logger.warning("Lost the connection to the client: {}".format(e))
+            self.close_connection = True
+
+    def _content_length(self):
+        length = self.headers.get('Content-Length')
+        if length is None or not length.isdigit():
+            raise ServiceError(411, "Send the body with a Content-Length")
+        return int(length)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, indent=True, sort_keys=True).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_output(self, job):
+        """Waits for the ``job`` to finish, and streams its output"""
+        job.done.wait()
+        if job.status != 'done':
+            raise ServiceError(500, "Job {} failed: {}".format(job.id, job.error))
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES[job.output_format])
+        self.send_header('Content-Length', str(os.path.getsize(job.target_file)))
+        self.send_header('X-Cow-Job', job.id)
+        self.end_headers()
+        with open(job.target_file, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, BLOCK_SIZE)
+
+    def log_message(self, format, *args):
+        # Clients of a Unix socket have no address
+        client = self.client_address[0] if self.client_address else 'unix socket'
+        logger.debug("{} {}".format(client, format % args))
+
+
+class ServiceHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ServiceUnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(address, **kwargs):
+    """Runs a :class:`ConversionService` (with the ``kwargs``) at ``address`` until it is interrupted or terminated.
+    The address is a [host:]port (the host defaults to localhost), or the path of a Unix socket."""
+    service = ConversionService(**kwargs)
+
+    unix_socket = address.startswith('unix:') or '/' in address
+    if unix_socket:
+        address = address[len('unix:'):] if address.startswith('unix:') else address
+        if os.path.exists(address):
+            # Left behind by a previous service
+            os.remove(address)
+        server = ServiceUnixServer(address, ServiceRequestHandler)
+    else:
+        host, _, port = address.rpartition(':')
+        server = ServiceHTTPServer((host or '127.0.0.1', int(port)), ServiceRequestHandler)
+    server.service = service
+
+    # Stop like on ctrl-c (the workers were started before, and keep the default handler)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logger.info("Serving conversions at {} with {} processes, {} jobs at a time".format(
+        address, service.processes, service.concurrency))
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Stopping the service")
+    finally:
+        server.server_close()
+        service.close()
+        if unix_socket and os.path.exists(address):
+            os.remove(address)
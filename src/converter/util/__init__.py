@@ -1,4 +1,4 @@
-from rdflib import Dataset, Graph, Namespace, RDF, RDFS, OWL, XSD, Literal, URIRef
+from rdflib import Dataset, Graph, Namespace, RDF, RDFS, OWL, XSD, Literal, URIRef, BNode
 import os
 import yaml
 import datetime
@@ -7,8 +7,37 @@ import logging
 import iribaker
 import urllib
 import uuid
+import re
+import io
+import sys
+import threading
+import math
+import struct
+import gzip
+import bz2
 
 from hashlib import sha1
+from collections import OrderedDict
+try:
+    # Python 3
+    from collections.abc import Mapping
+except ImportError:
+    # Python 2
+    from collections import Mapping
+
+try:
+    # Python 3
+    import lzma
+except ImportError:
+    # Python 2
+    lzma = None
+
+try:
+    # Python 2
+    text_type = unicode
+except NameError:
+    # Python 3
+    text_type = str
 
 
 logger = logging.getLogger(__name__)
@@ -24,6 +53,56 @@ Initialize a set of default namespaces from a configuration file (namespaces.yam
 namespaces = {}
 YAML_NAMESPACE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'namespaces.yaml')
 
+# Use the (much faster) LibYAML based loader if it is available
+YAML_LOADER = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+
+
+class NamespaceRegistry(Mapping):
+    """
+    An immutable, process-local mapping from prefixes to RDFLib ``Namespace`` objects, with
+    precomputed lookup tables. Use :meth:`with_base` to obtain a registry for another base URI,
+    and :func:`save_namespaces` to (explicitly) store a registry in namespaces.yaml.
+    """
+
+    def __init__(self, mapping):
+        self._namespaces = dict((prefix, Namespace(uri)) for prefix, uri in mapping.items())
+        # Namespace URI to prefix, for abbreviating IRIs (the alphabetically first prefix wins)
+        self._prefixes = {}
+        for prefix in sorted(self._namespaces):
+            self._prefixes.setdefault(text_type(self._namespaces[prefix]), prefix)
+        self._bases = {}
+
+    def __getitem__(self, prefix):
+        return self._namespaces[prefix]
+
+    def __iter__(self):
+        return iter(self._namespaces)
+
+    def __len__(self):
+        return len(self._namespaces)
+
+    def __reduce__(self):
+        return (NamespaceRegistry, (self._namespaces,))
+
+    def prefixes(self):
+        """Returns a dictionary from namespace URI to prefix"""
+        return dict(self._prefixes)
+
+    def expand(self, qname):
+        """Expands a prefixed name (e.g. ``skos:Concept``) to a URIRef"""
+        prefix, _, local = qname.partition(':')
+        return URIRef(self._namespaces[prefix] + local)
+
+    def with_base(self, base):
+        """Returns a registry in which the ``sdr`` and ``sdv`` namespaces are derived from ``base``"""
+        registry = self._bases.get(base)
+        if registry is None:
+            mapping = dict(self._namespaces)
+            mapping['sdr'] = text_type(base + u'/')
+            mapping['sdv'] = text_type(base + u'/vocab/')
+            registry = self._bases[base] = NamespaceRegistry(mapping)
+        return registry
+
 
 def init():
     """
@@ -31,13 +110,11 @@ def init():
     """
     # Read the file into a dictionary
     with open(YAML_NAMESPACE_FILE, 'r') as nsfile:
-        global namespaces
-        namespaces = yaml.load(nsfile, Loader=yaml.FullLoader)
+        loaded = yaml.load(nsfile, Loader=YAML_LOADER)
 
-    # Replace each value with a Namespace object for that value
-    for prefix, uri in namespaces.items():
-        if isinstance(prefix, str) and isinstance(uri, str):
-            namespaces[prefix] = Namespace(uri)
+    # The registry turns each value into a Namespace object for that value
+    global namespaces
+    namespaces = NamespaceRegistry(loaded)
 
     # Add all namespace prefixes to the globals dictionary (for exporting)
     for prefix, namespace in namespaces.items():
@@ -70,6 +147,159 @@ def serializeTrig(rdf_dataset):
     return "\n".join(turtles)
 
 
+# Serialization formats that can be written chunk by chunk, by the StreamingGraph (and 'binary' by the DictionaryGraph)
+STREAMING_FORMATS = ('nquads', 'nt', 'turtle', 'trig', 'binary')
+# Of which these are written line by line
+LINE_FORMATS = ('nquads', 'nt')
+# And these group the triples by subject, and abbreviate IRIs using the default namespaces
+GROUPED_FORMATS = ('turtle', 'trig')
+
+# Conservative patterns for prefixes and local names that can be used in Turtle prefixed names
+PREFIX_PATTERN = re.compile(r'^[A-Za-z]([A-Za-z0-9_-]*[A-Za-z0-9_])?$')
+LOCAL_NAME_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_-]*$')
+
+
+def prefix_map():
+    """Returns a dictionary from namespace URI to prefix for the default namespaces that can be used in Turtle"""
+    return dict((uri, prefix) for uri, prefix in namespaces.prefixes().items()
+                if PREFIX_PATTERN.match(prefix) and u' ' not in uri)
+
+
+def prefix_header(output_format):
+    """Returns the prefix declarations for the default namespaces (only for Turtle and TriG) as UTF-8 encoded bytes"""
+    if output_format not in GROUPED_FORMATS:
+        return b''
+    prefixes = prefix_map()
+    return u''.join(u'@prefix %s: <%s> .\n' % (prefix, uri)
+                    for prefix, uri in sorted((p, u) for u, p in prefixes.items())).encode('utf-8') + b'\n'
+
+
+def quote_lexical(value):
+    """Returns the quoted (and escaped) lexical form of a literal ``value``, without language or datatype"""
+    return u'"%s"' % value.replace(u'\\', u'\\\\')\
+        .replace(u'\n', u'\\n')\
+        .replace(u'"', u'\\"')\
+        .replace(u'\r', u'\\r')
+
+
+def quote_term(term, prefixes=None):
+    """Returns the N-Triples/N-Quads representation of an RDFLib term, or its Turtle representation
+    when ``prefixes`` (see :func:`prefix_map`) are given"""
+    if isinstance(term, Literal):
+        encoded = quote_lexical(term)
+        if term.language:
+            return u'%s@%s' % (encoded, term.language)
+        elif term.datatype:
+            return u'%s^^%s' % (encoded, quote_term(term.datatype, prefixes))
+        return encoded
+    elif isinstance(term, BNode):
+        return u'_:%s' % term
+    elif prefixes:
+        # Abbreviate the IRI if its namespace (up to the last '/' or '#') has a prefix
+        split = max(term.rfind(u'/'), term.rfind(u'#')) + 1
+        prefix = prefixes.get(term[:split])
+        if prefix is not None and LOCAL_NAME_PATTERN.match(term[split:]):
+            return u'%s:%s' % (prefix, term[split:])
+    return u'<%s>' % term
+
+
+def ascii_escape(line):
+    """Escapes all non-ASCII characters in ``line`` as required by (RDF 1.0) N-Triples"""
+    return u''.join(c if ord(c) < 128 else
+                    (u'\\u%04X' % ord(c) if ord(c) <= 0xFFFF else u'\\U%08X' % ord(c))
+                    for c in line)
+
+
+class StreamingGraph(object):
+    """
+    A write-only stand-in for an RDFLib graph that formats each triple as soon as it is added, instead of
+    indexing it in a store and serializing it afterwards. N-Quads and N-Triples are written line by line,
+    Turtle and TriG are grouped by subject (and for TriG wrapped in a block for the ``identifier`` graph);
+    they use the prefixes written by :func:`prefix_header`.
+
+    Only triples added with ``unique=False`` (the default) are remembered for deduplication; triples
+    that cannot be produced twice (e.g. the cells of a row with its own subject) should be added
+    with ``unique=True`` to keep memory bounded by the size of the output.
+    """
+
+    def __init__(self, identifier=None, output_format='nquads'):
+        if output_format not in LINE_FORMATS + GROUPED_FORMATS:
+            raise Exception("Cannot stream to {}, use one of {}".format(output_format, LINE_FORMATS + GROUPED_FORMATS))
+
+        self.identifier = identifier
+        self.output_format = output_format
+
+        # The end of N-Quads and N-Triples lines, after the object
+        if output_format == 'nquads' and identifier is not None:
+            self.line_suffix = u' %s .\n' % quote_term(URIRef(identifier))
+        else:
+            self.line_suffix = u' .\n'
+
+        self._grouped = output_format in GROUPED_FORMATS
+        self._prefixes = prefix_map() if self._grouped else None
+
+        self._lines = []
+        # The predicate/object pairs of each subject, for grouped formats
+        self._subjects = OrderedDict()
+        self._seen = set()
+        self._count = 0
+
+    def add(self, triple, unique=False):
+        """Formats the (s, p, o) ``triple`` and appends it to the buffer (unless it was added before)"""
+        s, p, o = triple
+
+        if self._grouped:
+            subject = quote_term(s, self._prefixes)
+            line = u'%s %s' % (quote_term(p, self._prefixes), quote_term(o, self._prefixes))
+            if not unique:
+                if (subject, line) in self._seen:
+                    return
+                self._seen.add((subject, line))
+            self._subjects.setdefault(subject, []).append(line)
+            self._count += 1
+            return
+
+        self.add_line(u'%s %s %s%s' % (quote_term(s), quote_term(p), quote_term(o), self.line_suffix), unique)
+
+    def add_line(self, line, unique=False):
+        """Appends an N-Quads or N-Triples ``line`` that was already formatted (ending in ``line_suffix``)"""
+        if not unique:
+            if line in self._seen:
+                return
+            self._seen.add(line)
+
+        self._lines.append(line)
+        self._count += 1
+
+    def __len__(self):
+        return self._count
+
+    def serialize(self, format=None):
+        """Returns the buffered triples as UTF-8 encoded bytes (N-Triples are escaped to ASCII)"""
+        if self._grouped:
+            return self._serialize_grouped()
+
+        output = u''.join(self._lines)
+        if (format or self.output_format) == 'nt':
+            output = ascii_escape(output)
+        return output.encode('utf-8')
+
+    def _serialize_grouped(self):
+        if not self._subjects:
+            return b''
+
+        indent = u'    ' if self.output_format == 'trig' else u''
+        separator = u' ;\n' + indent + u'    '
+        statements = [u'%s%s %s .\n' % (indent, subject, separator.join(lines))
+                      for subject, lines in self._subjects.items()]
+
+        if self.output_format == 'trig':
+            output = u'%s {\n%s}\n\n' % (quote_term(URIRef(self.identifier), self._prefixes), u''.join(statements))
+        else:
+            output = u''.join(statements) + u'\n'
+        return output.encode('utf-8')
+
+
 def git_hash(data):
     """
     Generates a Git-compatible hash for identifying (the current version of) the data
@@ -81,6 +311,159 @@ def git_hash(data):
     return s.hexdigest()
 
 
+# Size of the buffer used to hash source files
+HASH_BUFFER_SIZE = 1024 * 1024
+
+# Bytes for which hashing the raw file may differ from hashing its decoded text (see git_hash_file)
+UNSAFE_HASH_BYTES = re.compile(b'[\r\x80-\xff]')
+
+
+def git_hash_file(file_name, buffer_size=HASH_BUFFER_SIZE):
+    """
+    Generates the same hash as :func:`git_hash` for the contents of ``file_name``, without
+    reading the whole file into memory.
+
+    The file is hashed as a Git blob, using the byte length from ``os.stat``. The old hash was
+    computed over the decoded text, so for files with non-ASCII bytes or carriage returns (under
+    Python 3) we fall back to counting and hashing the decoded text in two streaming passes.
+    """
+    s = sha1()
+    s.update("blob {}\0".format(os.stat(file_name).st_size).encode('utf-8'))
+    safe = True
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(buffer_size), b''):
+            if safe and UNSAFE_HASH_BYTES.search(block):
+                safe = False
+            s.update(block)
+
+    if safe or sys.version_info[0] < 3:
+        return s.hexdigest()
+
+    logger.debug("Hashing decoded text of {} for compatibility with earlier versions".format(file_name))
+    length = 0
+    with io.open(file_name, 'r', errors='ignore') as f:
+        for block in iter(lambda: f.read(buffer_size), u''):
+            length += len(block)
+
+    s = sha1()
+    s.update("blob {}\0".format(length).encode('utf-8'))
+    with io.open(file_name, 'r', errors='ignore') as f:
+        for block in iter(lambda: f.read(buffer_size), u''):
+            s.update(block.encode('utf-8'))
+    return s.hexdigest()
+
+
+# The file name suffixes of the compressed (CSV) files that can be read
+COMPRESSION_SUFFIXES = ('.gz', '.bz2', '.xz')
+
+
+def compression(file_name):
+    """Returns the compression suffix of ``file_name`` (see COMPRESSION_SUFFIXES), or None"""
+    for suffix in COMPRESSION_SUFFIXES:
+        if file_name.endswith(suffix):
+            return suffix
+    return None
+
+
+def strip_compression(file_name):
+    """Returns ``file_name`` without its compression suffix, e.g. the name its schema and output are derived from"""
+    suffix = compression(file_name)
+    if suffix is None:
+        return file_name
+    return file_name[:-len(suffix)]
+
+
+def open_compressed(file_name):
+    """Opens ``file_name`` for reading bytes, and decompresses it while it is read if it has a compression suffix"""
+    suffix = compression(file_name)
+    if suffix == '.gz':
+        return gzip.open(file_name, 'rb')
+    elif suffix == '.bz2':
+        return bz2.BZ2File(file_name, 'rb')
+    elif suffix == '.xz':
+        if lzma is None:
+            raise Exception("Cannot read {}: xz compressed files require the lzma module".format(file_name))
+        return lzma.open(file_name, 'rb')
+    return open(file_name, 'rb')
+
+
+def gzip_member(data, compresslevel=6):
+    """Compresses ``data`` as a complete gzip member. Concatenated members form a valid gzip file, so that chunks can
+    be compressed independently (and in parallel)."""
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=compresslevel, mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+class SourceHash(object):
+    """
+    Computes :func:`git_hash_file` for ``file_name``, optionally in a background thread so that
+    hashing a large source file overlaps with other initialization work. Call :meth:`hexdigest`
+    to obtain (or wait for) the result.
+    """
+
+    def __init__(self, file_name, background=False):
+        self.file_name = file_name
+        self._digest = None
+        self._error = None
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._run, name='cow-source-hash')
+            self._thread.daemon = True
+            self._thread.start()
+        else:
+            self._run()
+
+    def _run(self):
+        try:
+            self._digest = git_hash_file(self.file_name)
+        except Exception as e:
+            self._error = e
+
+    def hexdigest(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            raise self._error
+        return self._digest
+
+
+class HyperLogLog(object):
+    """
+    A HyperLogLog sketch for estimating the number of distinct (text) values in constant memory.
+    Sketches with the same ``precision`` can be merged, e.g. after counting in separate processes.
+    """
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        x = struct.unpack('>Q', sha1(value.encode('utf-8')).digest()[:8])[0]
+        bits = 64 - self.precision
+        # The register is given by the first bits of the hash, the rank by the position of the first 1 in the rest
+        index = x >> bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Merges the ``other`` sketch into this one"""
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def __len__(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = sum(1 for r in self.registers if r == 0)
+        if estimate <= 2.5 * m and zeros:
+            # Use linear counting for small cardinalities
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+
 def apply_default_namespaces(graph):
     """
     Apply a set of default namespaces to the RDFLib graph
@@ -94,21 +477,19 @@ def apply_default_namespaces(graph):
 
 
 def get_namespaces(base=None):
-    """Return the global namespaces"""
+    """Return the global namespaces, with the ``sdr`` and ``sdv`` namespaces derived from ``base`` if it is given"""
     if base:
-        try:
-            # Python 2
-            namespaces['sdr'] = Namespace(unicode(base + u'/'))
-            namespaces['sdv'] = Namespace(unicode(base + u'/vocab/'))
-        except NameError:
-            # Python 3
-            namespaces['sdr'] = Namespace(str(base + u'/'))
-            namespaces['sdv'] = Namespace(str(base + u'/vocab/'))
-        with open(YAML_NAMESPACE_FILE, 'w') as outfile:
-            yaml.dump(namespaces, outfile, default_flow_style=True)
+        return namespaces.with_base(base)
     return namespaces
 
 
+def save_namespaces(registry, path=YAML_NAMESPACE_FILE):
+    """Stores the namespaces in ``registry`` in the YAML file at ``path`` (by default, the package's namespaces.yaml)"""
+    logger.info("Saving namespaces to {}".format(path))
+    with open(path, 'w') as outfile:
+        yaml.dump(dict(registry), outfile, default_flow_style=True)
+
+
 def safe_url(NS, local):
     """Generates a URIRef from the namespace + local part that is safe for
     use in RDF graphs
@@ -297,14 +678,18 @@ class Nanopublication(Dataset):
     NOTE: Will only work if the required namespaces are specified in namespaces.yaml and the init() function has been called
     """
 
-    def __init__(self, file_name):
+    def __init__(self, file_name, source_hash=None, timestamp=None, default_graph=None):
         """
-        Initialize the graphs needed for the nanopublication
+        Initialize the graphs needed for the nanopublication. The hash of the source file can be
+        passed as ``source_hash`` (a string, or a :class:`SourceHash` that may still be running).
+        The ``timestamp`` and ``default_graph`` name are only given to recreate an earlier nanopublication.
         """
         super(Dataset, self).__init__()
 
         # Virtuoso does not accept BNodes as graph names
-        self.default_context = Graph(store=self.store, identifier=URIRef(uuid.uuid4().urn))
+        if default_graph is None:
+            default_graph = uuid.uuid4().urn
+        self.default_context = Graph(store=self.store, identifier=URIRef(default_graph))
 
 
         # Assign default namespace prefixes
@@ -312,14 +697,16 @@ class Nanopublication(Dataset):
             self.bind(prefix, namespace)
 
         # Get the current date and time (UTC)
-        timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M")
+        if timestamp is None:
+            timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M")
+        self.timestamp = timestamp
 
         # Obtain a hash of the source file used for the conversion.
         # TODO: Get this directly from GitLab
-        try: #Python 3
-            source_hash = git_hash(open(file_name, 'r', errors='ignore').read())
-        except TypeError: #Python 2
-            source_hash = git_hash(open(file_name, 'r').read())
+        if source_hash is None:
+            source_hash = SourceHash(file_name)
+        if isinstance(source_hash, SourceHash):
+            source_hash = source_hash.hexdigest()
 
         # Shorten the source hash to 8 digits (similar to Github)
         short_hash = source_hash[:8]
@@ -1,83 +1,183 @@
 try:
     # git install
-    from converter.csvw import CSVWConverter, build_schema, extensions
+    from converter.csvw import CSVWConverter, ConversionPool, build_schema, extensions, STREAMING_FORMATS, SAMPLE_SIZE
+    from converter.util import strip_compression
+    from converter.bench import run_benchmarks
+    from converter.service import serve
 except ImportError:
     # pip install
-    from cow_csvw.converter.csvw import CSVWConverter, build_schema, extensions
+    from cow_csvw.converter.csvw import CSVWConverter, ConversionPool, build_schema, extensions, STREAMING_FORMATS, SAMPLE_SIZE
+    from cow_csvw.converter.util import strip_compression
+    from cow_csvw.converter.bench import run_benchmarks
+    from cow_csvw.converter.service import serve
 import os
+import gzip
 import datetime
 import argparse
 import sys
 import traceback
 from glob import glob
+from functools import partial
+from multiprocessing.pool import ThreadPool
 from rdflib import ConjunctiveGraph
 from werkzeug.utils import secure_filename
 
 class COW(object):
 
-    def __init__(self, mode=None, files=None, dataset=None, delimiter=None, quotechar='\"', processes=4, chunksize=5000, base="https://iisg.amsterdam/", output_format='nquads'):
+    def __init__(self, mode=None, files=None, dataset=None, delimiter=None, quotechar='\"', processes=4, chunksize=5000, base="https://iisg.amsterdam/", output_format='nquads', iri_cache_size=100000, sharded=False, unordered=False, completion_order=False, save_namespaces=False, sample_size=SAMPLE_SIZE, profile=False, force=False, resume=False, bench_rows=10000, profiler=None, in_flight=None, compress=False, engine='row', write_queue=16, fsync=False, upload=None, concurrent_files=None, queue_size=100):
         """
         COW entry point
         """
 
-        for source_file in files:
-            if mode == 'build':
-                print("Building schema for {}".format(source_file))
-                target_file = "{}-metadata.json".format(source_file)
-
-                if os.path.exists(target_file):
-                    modifiedTime = os.path.getmtime(target_file)
-                    timestamp = datetime.datetime.fromtimestamp(modifiedTime).isoformat()
-                    os.rename(target_file, secure_filename(target_file+"_"+timestamp))
-                    print("Backed up prior version of schema to {}".format(target_file+"_"+timestamp))
-
-                build_schema(source_file, target_file, dataset_name=dataset, delimiter=delimiter, quotechar=quotechar, base=base)
-
-            elif mode == 'convert':
-                print("Converting {} to RDF".format(source_file))
-
+        def build_arguments(source_file):
+            """Backs up the current schema of the source file, and returns the arguments to build a new one"""
+            print("Building schema for {}".format(source_file))
+            target_file = "{}-metadata.json".format(strip_compression(source_file))
+
+            if os.path.exists(target_file):
+                modifiedTime = os.path.getmtime(target_file)
+                timestamp = datetime.datetime.fromtimestamp(modifiedTime).isoformat()
+                os.rename(target_file, secure_filename(target_file+"_"+timestamp))
+                print("Backed up prior version of schema to {}".format(target_file+"_"+timestamp))
+
+            return dict(infile=source_file, outfile=target_file, dataset_name=dataset, delimiter=delimiter, quotechar=quotechar, base=base, persist_namespaces=save_namespaces, sample_size=sample_size, profile=profile, processes=processes, chunksize=chunksize)
+
+        def convert(source_file, pool=None):
+            print("Converting {} to RDF".format(source_file))
+
+            try:
+                # Formats that cannot be written chunk by chunk are converted from nquads afterwards
+                streaming = output_format in STREAMING_FORMATS
+                c = CSVWConverter(source_file, delimiter=delimiter, quotechar=quotechar, processes=processes, chunksize=chunksize, output_format=output_format if streaming else 'nquads', iri_cache_size=iri_cache_size, sharded=sharded, unordered=unordered, completion_order=completion_order, force=force, resume=resume, profile=profile, profiler=profiler, in_flight=in_flight, compress=compress and streaming, engine=engine, write_queue=write_queue, fsync=fsync, upload=upload, pool=pool)
+                converted = c.convert()
+
+                # We convert the output serialization if it cannot be streamed
+                output_file_name = strip_compression(source_file) + '.' + extensions[output_format]
+                if compress:
+                    output_file_name += '.gz'
+                if not streaming and (converted or not os.path.exists(output_file_name)):
+                    with open(c.target_file, 'rb') as nquads_file:
+                        g = ConjunctiveGraph()
+                        g.parse(nquads_file, format='nquads')
+                    # We serialize in the requested format
+                    with (gzip.open if compress else open)(output_file_name, 'wb') as output_file:
+                        output_file.write(g.serialize(format=output_format))
+
+            except ValueError:
+                raise
+            except:
+                print("Something went wrong, skipping {}.".format(source_file))
+                traceback.print_exc(file=sys.stdout)
+
+        if mode in ('build', 'convert'):
+            # Every file only once, the largest first: while it is converted, the chunks of the smaller files
+            # fill up the processes, instead of the largest file keeping them waiting at the end
+            files = sorted(set(files), key=lambda f: (-os.path.getsize(f), f))
+
+        if mode == 'serve':
+            # The service converts the files it is sent, until it is stopped
+            serve(files[0], processes=processes, concurrency=concurrent_files, queue_size=queue_size, chunksize=chunksize, output_format=output_format, iri_cache_size=iri_cache_size)
+
+        elif mode == 'build' and processes > 1 and len(files) > 1:
+            # The schemas are built in parallel, a file per process
+            builds = [build_arguments(source_file) for source_file in files]
+            with ConversionPool(min(processes, len(files))) as pool:
+                for target_file in pool.build_schemas(builds):
+                    print("Built schema {}".format(target_file))
+
+        elif mode == 'convert' and processes > 1 and len(files) > 1:
+            # A single pool of processes converts the chunks of all files, of (at most) concurrent_files at a time,
+            # and each file is written to its own output file by the thread that converts it
+            with ConversionPool(processes) as pool:
+                threads = ThreadPool(concurrent_files or processes)
                 try:
-                    c = CSVWConverter(source_file, delimiter=delimiter, quotechar=quotechar, processes=processes, chunksize=chunksize, output_format='nquads')
-                    c.convert()
-
-                    # We convert the output serialization if different from nquads
-                    if output_format not in ['nquads']:
-                        with open(source_file + '.' + 'nq', 'rb') as nquads_file:
-                            g = ConjunctiveGraph()
-                            g.parse(nquads_file, format='nquads')
-                        # We serialize in the requested format
-                        with open(source_file + '.' + extensions[output_format], 'w') as output_file:
-                            output_file.write(g.serialize(format=output_format))
-
-                except ValueError:
-                    raise
-                except:
-                    print("Something went wrong, skipping {}.".format(source_file))
-                    traceback.print_exc(file=sys.stdout)
-            else:
-                print("Whoops for file {}".format(f))
+                    for _ in threads.imap_unordered(partial(convert, pool=pool), files):
+                        pass
+                finally:
+                    threads.close()
+                    threads.join()
+
+        else:
+            for source_file in files:
+                if mode == 'build':
+                    build_schema(**build_arguments(source_file))
+
+                elif mode == 'convert':
+                    convert(source_file)
+
+                elif mode == 'bench':
+                    print("Benchmarking the converter, writing the results to {}".format(source_file))
+                    # Compare a single process to 2, 4, ... up to the given number of processes
+                    process_counts = [1]
+                    while process_counts[-1] * 2 <= processes:
+                        process_counts.append(process_counts[-1] * 2)
+                    if processes > process_counts[-1]:
+                        process_counts.append(processes)
+                    run_benchmarks(source_file, rows=bench_rows, processes=process_counts,
+                                   chunksizes=sorted(set([max(1, chunksize // 10), chunksize])))
+                else:
+                    print("Whoops for file {}".format(f))
 
 def main():
     parser = argparse.ArgumentParser(description="Not nearly CSVW compliant schema builder and RDF converter")
-    parser.add_argument('mode', choices=['convert','build'], default='convert', help='Use the schema of the `file` specified to convert it to RDF, or build a schema from scratch.')
-    parser.add_argument('files', metavar='file', nargs='+', type=str, help="Path(s) of the file(s) that should be used for building or converting. Must be a CSV file.")
+    parser.add_argument('mode', choices=['convert','build','bench','serve'], default='convert', help='Use the schema of the `file` specified to convert it to RDF, build a schema from scratch, benchmark the converter, or run a conversion service (see converter/service.py).')
+    parser.add_argument('files', metavar='file', nargs='+', type=str, help="Path(s) of the file(s) that should be used for building or converting. Must be a CSV file. When benchmarking, the JSON file to write the results to. When serving, the [host:]port or Unix socket path to listen at.")
     parser.add_argument('--dataset', dest='dataset', type=str, help="A short name (slug) for the name of the dataset (will use input file name if not specified)")
     parser.add_argument('--delimiter', dest='delimiter', default=None, type=str, help="The delimiter used in the CSV file(s)")
     parser.add_argument('--quotechar', dest='quotechar', default='\"', type=str, help="The character used as quotation character in the CSV file(s)")
     parser.add_argument('--processes', dest='processes', default='4', type=int, help="The number of processes the converter should use")
+    parser.add_argument('--concurrentfiles', dest='concurrent_files', default=None, type=int, help="The number of files that are converted at the same time, sharing the processes (default: the number of processes; only with more than one process, and more than one file or when serving)")
+    parser.add_argument('--queuesize', dest='queue_size', default='100', type=int, help="The number of files that can wait for their conversion (only relevant when serving)")
     parser.add_argument('--chunksize', dest='chunksize', default='5000', type=int, help="The number of rows processed at each time")
+    parser.add_argument('--iricachesize', dest='iri_cache_size', default='100000', type=int, help="The number of generated IRIs each process keeps in its cache of validated IRIs (0 disables the cache)")
+    parser.add_argument('--inflight', dest='in_flight', default=None, type=int, help="The maximum number of chunks that are read but not yet converted and written by the processes (default: twice the number of processes)")
+    parser.add_argument('--engine', dest='engine', choices=['row', 'columnar'], default='row', help="Convert the rows one by one, or convert columns that only use plain {column} patterns a column at a time (only for nquads and nt output)")
+    parser.add_argument('--writequeue', dest='write_queue', default='16', type=int, help="The number of converted chunks that can be queued for the thread that writes them to the output file")
+    parser.add_argument('--fsync', dest='fsync', action='store_true', help="Sync the output file to disk after every 64MB written (and only checkpoint chunks once they are synced)")
+    parser.add_argument('--upload', dest='upload', default=None, type=str, metavar='ENDPOINT', help="Upload the converted triples to the assertion graph in the triple store at this Graph Store Protocol (or SPARQL Update) endpoint while converting (only for nquads and nt output)")
+    parser.add_argument('--uploadprotocol', dest='upload_protocol', choices=['gsp', 'update'], default='gsp', help="POST the triples to the graph with the SPARQL Graph Store Protocol, or send INSERT DATA requests with SPARQL Update")
+    parser.add_argument('--uploadbatch', dest='upload_batch', default='50000', type=int, help="The number of triples uploaded in each request")
+    parser.add_argument('--uploadconnections', dest='upload_connections', default='4', type=int, help="The number of concurrent (keep-alive) connections to the upload endpoint")
+    parser.add_argument('--uploadretries', dest='upload_retries', default='5', type=int, help="The number of times a failed upload request is retried, with exponential backoff")
+    parser.add_argument('--sharded', dest='sharded', action='store_true', help="Let each process read and parse its own part of the CSV file, instead of reading it in a single process (only with more than one process)")
+    parser.add_argument('--unordered', dest='unordered', action='store_true', help="Let processes complete their chunks out of order, spilling the results to disk until they can be written in order")
+    parser.add_argument('--completionorder', dest='completion_order', action='store_true', help="Write the converted chunks in the order they complete instead of in file order (implies --unordered)")
     parser.add_argument('--base', dest='base', default='https://iisg.amsterdam/', type=str, help="The base for URIs generated with the schema (only relevant when `build`ing a schema)")
-    parser.add_argument('--format', '-f', dest='format', nargs='?', choices=['xml', 'n3', 'turtle', 'nt', 'pretty-xml', 'trix', 'trig', 'nquads'], default='nquads', help="RDF serialization format")
+    parser.add_argument('--savenamespaces', dest='save_namespaces', action='store_true', help="Store the namespaces derived from --base in the package's namespaces.yaml (only relevant when `build`ing a schema)")
+    parser.add_argument('--samplesize', dest='sample_size', default=SAMPLE_SIZE, type=int, help="The number of bytes sampled from the head, middle and tail of the file to detect its encoding and delimiter (only relevant when `build`ing a schema)")
+    parser.add_argument('--profile', dest='profile', action='store_true', help="When `build`ing a schema, profile the columns in parallel to infer their datatypes, null values and number of distinct values. When `convert`ing, write a report of the time spent in each stage of the conversion to <output>.profile.json")
+    parser.add_argument('--profiler', dest='profiler', choices=['cprofile', 'tracemalloc'], default=None, help="Also run cProfile or tracemalloc in every process of the conversion, and add the results to the profile report (implies --profile, only relevant when `convert`ing)")
+    parser.add_argument('--compress', dest='compress', action='store_true', help="Write the output gzip compressed (.gz), with every chunk compressed by the process that converted it. Source files ending in .gz, .bz2 or .xz are always decompressed while reading")
+    parser.add_argument('--force', dest='force', action='store_true', help="Convert the file(s) even if the file, its schema and the options did not change since the previous conversion")
+    parser.add_argument('--resume', dest='resume', action='store_true', help="Resume an interrupted (parallel) conversion of the file(s) from its last completed chunk")
+    parser.add_argument('--benchrows', dest='bench_rows', default='10000', type=int, help="The number of rows of the synthetic CSV files (only relevant when `bench`marking)")
+    parser.add_argument('--format', '-f', dest='format', nargs='?', choices=['xml', 'n3', 'turtle', 'nt', 'pretty-xml', 'trix', 'trig', 'nquads', 'binary'], default='nquads', help="RDF serialization format ('binary' is a compact dictionary encoded format, see converter/binary.py)")
 
     parser.add_argument('--version', dest='version', action='version', version='x.xx')
 
     args = parser.parse_args()
 
     files = []
-    for f in args.files:
-        files += glob(f)
-
-    COW(args.mode, files, args.dataset, args.delimiter, args.quotechar, args.processes, args.chunksize, args.base, args.format)
+    if args.mode in ('bench', 'serve'):
+        # The results files do not exist yet, and the service listens at an address
+        files = args.files
+    else:
+        for f in args.files:
+            files += glob(f)
+
+    upload = None
+    if args.upload is not None:
+        upload = {'endpoint': args.upload, 'protocol': args.upload_protocol, 'batch_size': args.upload_batch,
+                  'connections': args.upload_connections, 'retries': args.upload_retries}
+
+    COW(mode=args.mode, files=files, dataset=args.dataset, delimiter=args.delimiter, quotechar=args.quotechar,
+        processes=args.processes, chunksize=args.chunksize, base=args.base, output_format=args.format,
+        iri_cache_size=args.iri_cache_size, sharded=args.sharded, unordered=args.unordered,
+        completion_order=args.completion_order, save_namespaces=args.save_namespaces, sample_size=args.sample_size,
+        profile=args.profile, force=args.force, resume=args.resume, bench_rows=args.bench_rows,
+        profiler=args.profiler, in_flight=args.in_flight, compress=args.compress, engine=args.engine,
+        write_queue=args.write_queue, fsync=args.fsync, upload=upload, concurrent_files=args.concurrent_files,
+        queue_size=args.queue_size)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the CSVWConverter, on synthetic datasets (see :func:`converter.bench.make_dataset`). The output of each mode
+is compared with that of a conversion in a single process. Run with ``python -m unittest discover tests`` (or pytest)
+from the root of the repository.
+"""
+
+import os
+import sys
+import time
+import shutil
+import signal
+import tempfile
+import threading
+import subprocess
+import unittest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+sys.path.insert(0, SRC)
+
+from rdflib import ConjunctiveGraph, Graph
+from rdflib.compare import isomorphic
+
+from converter.bench import make_dataset
+from converter.csvw import CSVWConverter, ConversionPool, SubmittedTasks
+
+
+def assertion_graph(file_name, output_format='nquads'):
+    """Returns the triples of the assertion graph in the N-Quads (or TriG) ``file_name``"""
+    g = ConjunctiveGraph()
+    g.parse(file_name, format=output_format)
+    assertion = Graph()
+    for context in g.contexts():
+        if u'/assertion/' in context.identifier:
+            for triple in context:
+                assertion.add(triple)
+    return assertion
+
+
+class ConversionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='cow-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def dataset(self, name='data', rows=500, **settings):
+        settings.setdefault('columns', 6)
+        return make_dataset(self.directory, name, rows, **settings)
+
+    def convert(self, csv_file, **kwargs):
+        """Converts ``csv_file`` (in a single process, unless given otherwise) and returns the converter"""
+        kwargs.setdefault('processes', 1)
+        kwargs.setdefault('chunksize', 100)
+        c = CSVWConverter(csv_file, force=True, **kwargs)
+        c.convert()
+        return c
+
+    def assertSameGraph(self, first, second):
+        self.assertGreater(len(first), 0)
+        self.assertEqual(len(first), len(second))
+        self.assertTrue(isomorphic(first, second))
+
+
+class SharedPoolTest(ConversionTest):
+
+    def test_shared_pool(self):
+        csv_file = self.dataset(coded=2)
+        expected = assertion_graph(self.convert(csv_file).target_file)
+        with ConversionPool(2) as pool:
+            c = self.convert(csv_file, processes=2, pool=pool)
+        self.assertSameGraph(assertion_graph(c.target_file), expected)
+        self.assertTrue(os.path.exists(c.manifest_file))
+
+    def test_corrupt_file(self):
+        # A file that cannot be read fails, and gets no manifest that would mark it as converted
+        csv_file = self.dataset(rows=2000)
+        with open(csv_file, 'rb') as f:
+            lines = f.readlines()
+        lines[1500] = b'\xff\xfe' + lines[1500]
+        with open(csv_file, 'wb') as f:
+            f.writelines(lines)
+
+        for unordered in (False, True):
+            with ConversionPool(2) as pool:
+                c = CSVWConverter(csv_file, processes=2, chunksize=100, force=True, unordered=unordered, pool=pool)
+                self.assertRaises(UnicodeDecodeError, c.convert)
+            self.assertFalse(os.path.exists(c.manifest_file))
+
+    def test_failed_task(self):
+        # A task that cannot be sent to the pool is raised, rather than waited for
+        with ConversionPool(1) as pool:
+            for ordered in (True, False):
+                tasks = SubmittedTasks(pool.pool, len, [[1], threading.Lock(), [1, 2]], ordered=ordered)
+                self.assertRaises(Exception, list, tasks)
+
+
+class SchemaTriplesTest(ConversionTest):
+
+    def test_written_once(self):
+        # The code list triples of all chunks, converted by different workers, are only written once
+        csv_file = self.dataset(rows=2000, coded=3)
+        for kwargs in ({}, {'unordered': True}):
+            c = self.convert(csv_file, processes=2, chunksize=100, **kwargs)
+            with open(c.target_file, 'rb') as f:
+                lines = [line for line in f if line.strip()]
+            self.assertEqual(len(lines), len(set(lines)))
+
+
+class ResumeTest(ConversionTest):
+
+    def interrupt(self, csv_file, processes, chunksize, chunks=3):
+        """Starts converting ``csv_file`` in another process, and kills it (and its workers) once at least ``chunks``
+        chunks are in the checkpoint"""
+        script = ("import sys; sys.path.insert(0, {!r}); from converter.csvw import CSVWConverter; "
+                  "CSVWConverter({!r}, processes={}, chunksize={}, force=True).convert()"
+                  "".format(SRC, csv_file, processes, chunksize))
+        with open(os.devnull, 'wb') as devnull:
+            process = subprocess.Popen([sys.executable, '-c', script], stdout=devnull, stderr=devnull,
+                                       preexec_fn=os.setsid)
+        checkpoint_file = csv_file + '.nq.checkpoint'
+        try:
+            while process.poll() is None:
+                if os.path.exists(checkpoint_file):
+                    with open(checkpoint_file, 'rb') as f:
+                        # The header and the chunks, the last line may not be complete
+                        if len(f.readlines()) > chunks + 1:
+                            break
+                time.sleep(0.01)
+        finally:
+            if process.poll() is None:
+                os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+        self.assertTrue(os.path.exists(checkpoint_file), "The conversion finished before it was interrupted")
+
+    def test_resume(self):
+        csv_file = self.dataset(rows=4000, coded=2)
+        expected = assertion_graph(self.convert(csv_file, chunksize=50).target_file)
+
+        self.interrupt(csv_file, 2, 50)
+        # The schema derived triples of the chunks depend on the workers that converted them
+        c = CSVWConverter(csv_file, processes=3, chunksize=50, resume=True)
+        self.assertRaises(Exception, c.convert)
+
+        c = CSVWConverter(csv_file, processes=2, chunksize=50, resume=True)
+        self.assertTrue(c.convert())
+        self.assertFalse(os.path.exists(c.checkpoint_file))
+        self.assertSameGraph(assertion_graph(c.target_file), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the GraphStoreUploader, against a stand-in triple store on localhost. Run with
+``python -m unittest discover tests`` (or pytest) from the root of the repository.
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+try:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qs
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+from converter.upload import GraphStoreUploader, UploadError
+
+GRAPH = 'https://example.org/graph/assertion'
+LINES = [b'<https://example.org/s> <https://example.org/p> "%d" .\n' % i for i in range(10)]
+
+
+class StoreHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        store = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        with store.lock:
+            store.requests.append((self.path, self.headers.get('Content-Type'), body))
+            status = store.statuses.pop(0) if store.statuses else 204
+        # Requests wait until the store is released, to keep them in flight
+        store.released.wait()
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class Store(ThreadingMixIn, HTTPServer):
+    """A stand-in triple store that records the requests, and answers them with the ``statuses`` (and 204 after
+    those)"""
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StoreHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.statuses = []
+        self.released = threading.Event()
+        self.released.set()
+
+    @property
+    def endpoint(self):
+        return 'http://127.0.0.1:{}/store'.format(self.server_address[1])
+
+
+class GraphStoreUploaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = Store()
+        self.thread = threading.Thread(target=self.store.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.store.released.set()
+        self.store.shutdown()
+        self.store.server_close()
+        self.thread.join()
+
+    def uploader(self, **kwargs):
+        kwargs.setdefault('backoff', 0.01)
+        return GraphStoreUploader(self.store.endpoint, GRAPH, **kwargs)
+
+    def test_gsp(self):
+        uploader = self.uploader(batch_size=4, connections=2)
+        uploader.add(b''.join(LINES))
+        uploader.close()
+
+        self.assertEqual(len(self.store.requests), 3)
+        bodies = []
+        for path, content_type, body in self.store.requests:
+            url = urlsplit(path)
+            self.assertEqual(url.path, '/store')
+            self.assertEqual(parse_qs(url.query)['graph'], [GRAPH])
+            self.assertEqual(content_type, 'application/n-triples')
+            bodies.append(body)
+        self.assertEqual(sorted(b''.join(bodies).splitlines(True)), sorted(LINES))
+        self.assertEqual(uploader.stats()['triples'], len(LINES))
+
+    def test_update(self):
+        uploader = self.uploader(protocol='update', batch_size=100)
+        uploader.add(b''.join(LINES))
+        uploader.close()
+
+        [(path, content_type, body)] = self.store.requests
+        self.assertEqual(path, '/store')
+        self.assertEqual(content_type, 'application/sparql-update; charset=utf-8')
+        prefix = u'INSERT DATA {{ GRAPH <{}> {{\n'.format(GRAPH).encode('utf-8')
+        self.assertTrue(body.startswith(prefix))
+        self.assertTrue(body.endswith(b'} }\n'))
+        self.assertEqual(body[len(prefix):-len(b'} }\n')], b''.join(LINES))
+
+    def test_line_suffix(self):
+        # Only the lines of the assertion graph are uploaded, as triples
+        suffix = u' <{}> .\n'.format(GRAPH)
+        quads = [line[:-len(b' .\n')] + suffix.encode('utf-8') for line in LINES]
+        other = b'<https://example.org/s> <https://example.org/p> "x" <https://example.org/graph/other> .\n'
+        uploader = self.uploader(line_suffix=suffix)
+        uploader.add(b''.join(quads) + other)
+        uploader.close()
+
+        [(_, _, body)] = self.store.requests
+        self.assertEqual(body, b''.join(LINES))
+
+    def test_retry(self):
+        self.store.statuses = [503, 503]
+        uploader = self.uploader(retries=2)
+        start = time.time()
+        uploader.add(b''.join(LINES))
+        uploader.close()
+
+        # The first retry waits at least half the backoff, the second at least the backoff
+        self.assertGreaterEqual(time.time() - start, 0.005 + 0.01)
+        self.assertEqual(len(self.store.requests), 3)
+        self.assertEqual(self.store.requests[-1][2], b''.join(LINES))
+        stats = uploader.stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['retries'], 2)
+
+    def test_give_up(self):
+        self.store.statuses = [503, 503, 503]
+        uploader = self.uploader(retries=2)
+        uploader.add(b''.join(LINES))
+        self.assertRaises(UploadError, uploader.close)
+        self.assertEqual(len(self.store.requests), 3)
+
+    def test_no_retry(self):
+        # Errors that are not temporary are not retried
+        self.store.statuses = [400]
+        uploader = self.uploader(retries=2)
+        uploader.add(b''.join(LINES))
+        self.assertRaises(UploadError, uploader.close)
+        self.assertEqual(len(self.store.requests), 1)
+        self.assertEqual(uploader.stats()['retries'], 0)
+
+    def test_in_flight(self):
+        # One batch is sent by the connection, and one waits for it, so adding a third batch blocks
+        self.store.released.clear()
+        uploader = self.uploader(batch_size=1, connections=1)
+        added = []
+
+        def add():
+            for line in LINES[:3]:
+                uploader.add(line)
+                added.append(line)
+
+        adder = threading.Thread(target=add)
+        adder.daemon = True
+        adder.start()
+        adder.join(0.5)
+        self.assertTrue(adder.is_alive())
+        self.assertEqual(len(added), 2)
+        self.assertEqual(len(self.store.requests), 1)
+
+        self.store.released.set()
+        adder.join(5)
+        self.assertFalse(adder.is_alive())
+        uploader.close()
+        self.assertEqual(len(self.store.requests), 3)
+        self.assertGreater(uploader.stats()['blocked_seconds'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()